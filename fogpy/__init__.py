@@ -25,5 +25,8 @@
 
 import os
 
+# Load the compiled filter kernels at package import
+import fogpy._kernels  # noqa: F401
+
 BASE_PATH = os.path.sep.join(os.path.dirname(
     os.path.realpath(__file__)).split(os.path.sep)[:-1])
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017
+# Author(s):
+#   Thomas Leppelt <thomas.leppelt@dwd.de>
+
+# This file is part of the fogpy package.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module implements fused pixel kernels for the fog masking filters
+
+The kernels are compiled with numba if it is installed, otherwise an
+equivalent numpy implementation is used. Numba can not handle masked arrays,
+therefore the kernels work on the plain array data.
+"""
+
+import logging
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+logger = logging.getLogger(__name__)
+
+# Bits of the per pixel stage code, set if the respective test masks the pixel
+CLOUD_STAGE = 1
+SNOW_STAGE = 2
+ICE_STAGE = 4
+CIRRUS_STAGE = 8
+
+
+def _snow_thres(dtype):
+    """Get the snow test constants in the precision of the channel data.
+
+    These are the reflectance scale, the minimum 0.8 μm reflectance and the
+    minimum NDSI. Typed constants keep the compiled and the numpy kernels in
+    the same precision as the snow filter.
+    """
+    return np.array([100, 0.11, 0.4], dtype=dtype)
+
+
+def _fog_mask_stages_loop(ir108, vis008, nir016, vis006, ir087, ir120,
+                          cloud_mask, cirrus_thres, snow_thres, stages):
+    """Snow, ice cloud and cirrus tests in one pass over the pixels."""
+    for i in prange(ir108.shape[0]):
+        for j in range(ir108.shape[1]):
+            bt108 = ir108[i, j]
+            # 1. Cloud test result of the cloud filter
+            cloud = cloud_mask[i, j]
+            # 2. Snow test
+            ndsi = ((vis006[i, j] - nir016[i, j]) /
+                    (vis006[i, j] + nir016[i, j]))
+            snow = ((vis008[i, j] / snow_thres[0] >= snow_thres[1]) &
+                    (bt108 >= 256) & (ndsi >= snow_thres[2]))
+            # 3. Ice cloud test
+            ice = (ir120[i, j] - ir087[i, j] < 2.5) | (bt108 < 250)
+            # 4. Thin and strong cirrus test
+            cirrus = ((bt108 - ir120[i, j] > cirrus_thres[i, j]) |
+                      (ir087[i, j] - bt108 > 0))
+            # Pack the test results into the stage bits without branching
+            stages[i, j] = (cloud * CLOUD_STAGE | snow * SNOW_STAGE |
+                            ice * ICE_STAGE | cirrus * CIRRUS_STAGE)
+
+
+def _fog_mask_stages_numpy(ir108, vis008, nir016, vis006, ir087, ir120,
+                           cloud_mask, cirrus_thres, snow_thres, stages):
+    """Numpy version of the fused snow, ice and cirrus tests."""
+    stages[...] = cloud_mask
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndsi = (vis006 - nir016) / (vis006 + nir016)
+    snow = ((vis008 / snow_thres[0] >= snow_thres[1]) & (ir108 >= 256) &
+            (ndsi >= snow_thres[2]))
+    stages |= snow * np.uint8(SNOW_STAGE)
+    ice = (ir120 - ir087 < 2.5) | (ir108 < 250)
+    stages |= ice * np.uint8(ICE_STAGE)
+    cirrus = (ir108 - ir120 > cirrus_thres) | (ir087 - ir108 > 0)
+    stages |= cirrus * np.uint8(CIRRUS_STAGE)
+
+
+# Kernel signatures for single and double precision channel data. The
+# kernels are compiled eagerly and cached on disk, so only the very first
+# import pays the compilation time. All arrays are C contiguous (::1), which
+# lets LLVM vectorize the inner loop without stride checks.
+_CHANNEL_TYPES = ('f4', 'f8')
+_FOG_MASK_STAGES_SIG = [('void(' + ', '.join(['{0}[:, ::1]'] * 6) +
+                         ', b1[:, ::1], f8[:, ::1], {0}[::1], u1[:, ::1])')
+                        .format(t) for t in _CHANNEL_TYPES]
+
+if njit is not None:
+    _fog_mask_stages = njit(_FOG_MASK_STAGES_SIG, parallel=True,
+                            nogil=True, cache=True,
+                            error_model='numpy')(_fog_mask_stages_loop)
+else:
+    logger.debug("Numba not available, using numpy filter kernels")
+    _fog_mask_stages = _fog_mask_stages_numpy
+
+
+def _as_channels(*arrays):
+    """Get C contiguous channel data with a common floating point type."""
+    channels = [np.ma.getdata(arr) for arr in arrays]
+    # Use a common floating point type matching the compiled kernels
+    dtype = np.result_type(*channels)
+    if dtype not in (np.float32, np.float64):
+        dtype = np.float64
+
+    return [np.ascontiguousarray(arr, dtype=dtype) for arr in channels]
+
+
+def fog_mask_stages(ir108, vis008, nir016, vis006, ir087, ir120, cloud_mask,
+                    cirrus_thres, out=None):
+    """Apply the snow, ice cloud and thin cirrus tests at once.
+
+    The tests are the same as in the :class:`SnowFilter`,
+    :class:`IceCloudFilter` and :class:`CirrusCloudFilter` classes, but every
+    pixel is only read once. The cloud mask of the :class:`CloudFilter` is
+    merged in the same pass. The results are packed into a single byte per
+    pixel, using the :data:`CLOUD_STAGE`, :data:`SNOW_STAGE`,
+    :data:`ICE_STAGE` and :data:`CIRRUS_STAGE` bits. A pixel is masked by the
+    combined filters if any bit is set.
+
+    Args:
+        | ir108 (:obj:`ndarray`): Array for the 10.8 μm channel.
+        | vis008 (:obj:`ndarray`): Array for the 0.8 μm channel.
+        | nir016 (:obj:`ndarray`): Array for the 1.6 μm channel.
+        | vis006 (:obj:`ndarray`): Array for the 0.6 μm channel.
+        | ir087 (:obj:`ndarray`): Array for the 8.7 μm channel.
+        | ir120 (:obj:`ndarray`): Array for the 12.0 μm channel.
+        | cloud_mask (:obj:`ndarray`): Cloud mask of the cloud filter.
+        | cirrus_thres (:obj:`ndarray`): Cirrus BT difference thresholds.
+        | out (:obj:`ndarray`): Optional C contiguous uint8 output array for
+                                the stage codes.
+
+    Returns:
+        Array of per pixel stage codes.
+    """
+    ir108, vis008, nir016, vis006, ir087, ir120 = _as_channels(
+        ir108, vis008, nir016, vis006, ir087, ir120)
+    cloud_mask = np.ascontiguousarray(np.ma.getdata(cloud_mask), dtype=bool)
+    cirrus_thres = np.ascontiguousarray(np.ma.getdata(cirrus_thres),
+                                        dtype=np.float64)
+    if out is None:
+        out = np.empty(ir108.shape, dtype=np.uint8)
+    _fog_mask_stages(ir108, vis008, nir016, vis006, ir087, ir120, cloud_mask,
+                     cirrus_thres, _snow_thres(ir108.dtype), out)
+
+    return out
+
+
+def _snow_mask_loop(vis006, vis008, nir016, ir108, snow_thres, mask):
+    """Snow test on flattened channel arrays."""
+    for k in prange(mask.shape[0]):
+        ndsi = (vis006[k] - nir016[k]) / (vis006[k] + nir016[k])
+        mask[k] = ((vis008[k] / snow_thres[0] >= snow_thres[1]) &
+                   (ir108[k] >= 256) & (ndsi >= snow_thres[2]))
+
+
+def _snow_mask_numpy(vis006, vis008, nir016, ir108, snow_thres, mask):
+    """Numpy version of the snow test."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndsi = (vis006 - nir016) / (vis006 + nir016)
+    np.greater_equal(vis008 / snow_thres[0], snow_thres[1], out=mask)
+    mask &= ir108 >= 256
+    mask &= ndsi >= snow_thres[2]
+
+
+_SNOW_MASK_SIG = ['void(' + ', '.join(['{0}[::1]'.format(t)] * 5) +
+                  ', b1[::1])' for t in _CHANNEL_TYPES]
+
+if njit is not None:
+    _snow_mask = njit(_SNOW_MASK_SIG, parallel=True, nogil=True, cache=True,
+                      error_model='numpy')(_snow_mask_loop)
+else:
+    _snow_mask = _snow_mask_numpy
+
+
+def snow_mask(vis006, vis008, nir016, ir108, out=None):
+    """Apply the snow test of the :class:`SnowFilter` in one pass.
+
+    Args:
+        | vis006 (:obj:`ndarray`): Array for the 0.6 μm channel.
+        | vis008 (:obj:`ndarray`): Array for the 0.8 μm channel.
+        | nir016 (:obj:`ndarray`): Array for the 1.6 μm channel.
+        | ir108 (:obj:`ndarray`): Array for the 10.8 μm channel.
+        | out (:obj:`ndarray`): Optional C contiguous boolean output array.
+
+    Returns:
+        Snow mask.
+    """
+    vis006, vis008, nir016, ir108 = _as_channels(vis006, vis008, nir016,
+                                                 ir108)
+    if out is None:
+        out = np.empty(ir108.shape, dtype=bool)
+    _snow_mask(vis006.ravel(), vis008.ravel(), nir016.ravel(), ir108.ravel(),
+               _snow_thres(ir108.dtype), out.reshape(-1))
+
+    return out
+
+
+def _ice_mask_loop(ir120, ir087, ir108, mask):
+    """Ice cloud test on flattened channel arrays."""
+    for k in prange(mask.shape[0]):
+        mask[k] = (ir120[k] - ir087[k] < 2.5) | (ir108[k] < 250)
+
+
+def _ice_mask_numpy(ir120, ir087, ir108, mask):
+    """Numpy version of the ice cloud test."""
+    np.less(ir120 - ir087, 2.5, out=mask)
+    mask |= ir108 < 250
+
+
+def _cirrus_mask_loop(ir108, ir087, ir120, bt_thres, mask):
+    """Thin and strong cirrus tests on flattened channel arrays."""
+    for k in prange(mask.shape[0]):
+        mask[k] = ((ir108[k] - ir120[k] > bt_thres[k]) |
+                   (ir087[k] - ir108[k] > 0))
+
+
+def _cirrus_mask_numpy(ir108, ir087, ir120, bt_thres, mask):
+    """Numpy version of the thin and strong cirrus tests."""
+    np.greater(ir108 - ir120, bt_thres, out=mask)
+    mask |= ir087 - ir108 > 0
+
+
+_ICE_MASK_SIG = ['void(' + ', '.join(['{0}[::1]'.format(t)] * 3) +
+                 ', b1[::1])' for t in _CHANNEL_TYPES]
+_CIRRUS_MASK_SIG = ['void(' + ', '.join(['{0}[::1]'.format(t)] * 3) +
+                    ', f8[::1], b1[::1])' for t in _CHANNEL_TYPES]
+
+if njit is not None:
+    _ice_mask = njit(_ICE_MASK_SIG, parallel=True, nogil=True, cache=True,
+                     error_model='numpy')(_ice_mask_loop)
+    _cirrus_mask = njit(_CIRRUS_MASK_SIG, parallel=True, nogil=True,
+                        cache=True, error_model='numpy')(_cirrus_mask_loop)
+else:
+    _ice_mask = _ice_mask_numpy
+    _cirrus_mask = _cirrus_mask_numpy
+
+
+def ice_mask(ir120, ir087, ir108, out=None):
+    """Apply the ice cloud test of the :class:`IceCloudFilter` in one pass.
+
+    Args:
+        | ir120 (:obj:`ndarray`): Array for the 12.0 μm channel.
+        | ir087 (:obj:`ndarray`): Array for the 8.7 μm channel.
+        | ir108 (:obj:`ndarray`): Array for the 10.8 μm channel.
+        | out (:obj:`ndarray`): Optional C contiguous boolean output array.
+
+    Returns:
+        Ice cloud mask.
+    """
+    ir120, ir087, ir108 = _as_channels(ir120, ir087, ir108)
+    if out is None:
+        out = np.empty(ir108.shape, dtype=bool)
+    _ice_mask(ir120.ravel(), ir087.ravel(), ir108.ravel(), out.reshape(-1))
+
+    return out
+
+
+def cirrus_mask(ir108, ir087, ir120, bt_thres, out=None):
+    """Apply the cirrus tests of the :class:`CirrusCloudFilter` in one pass.
+
+    Args:
+        | ir108 (:obj:`ndarray`): Array for the 10.8 μm channel.
+        | ir087 (:obj:`ndarray`): Array for the 8.7 μm channel.
+        | ir120 (:obj:`ndarray`): Array for the 12.0 μm channel.
+        | bt_thres (:obj:`ndarray`): Thin cirrus BT difference thresholds.
+        | out (:obj:`ndarray`): Optional C contiguous boolean output array.
+
+    Returns:
+        Cirrus cloud mask.
+    """
+    ir108, ir087, ir120 = _as_channels(ir108, ir087, ir120)
+    bt_thres = np.ma.getdata(bt_thres)
+    if np.shape(bt_thres) != ir108.shape:
+        bt_thres = np.broadcast_to(bt_thres, ir108.shape)
+    # Broadcasted arrays are read only and don't match the kernel signature
+    bt_thres = np.require(bt_thres, np.float64, ['C', 'W'])
+    if out is None:
+        out = np.empty(ir108.shape, dtype=bool)
+    _cirrus_mask(ir108.ravel(), ir087.ravel(), ir120.ravel(),
+                 bt_thres.ravel(), out.reshape(-1))
+
+    return out
+
+
+def _cloud_confidence_loop(diff, thres, ccr, scale, ccl, mask):
+    """Cloud confidence level and cloud test on flattened BT differences."""
+    for k in prange(mask.shape[0]):
+        level = (diff[k] - thres - ccr) / scale
+        # Limit range to 0 (cloudfree) and 1 (cloudy)
+        if level > 1:
+            level = 1
+        elif level < 0:
+            level = 0
+        ccl[k] = level
+        mask[k] = diff[k] > thres
+
+
+def _cloud_confidence_numpy(diff, thres, ccr, scale, ccl, mask):
+    """Numpy version of the cloud confidence level and cloud test."""
+    np.subtract(diff, thres, out=ccl)
+    ccl -= ccr
+    ccl /= scale
+    np.clip(ccl, 0, 1, out=ccl)
+    np.greater(diff, thres, out=mask)
+
+
+_CLOUD_CONFIDENCE_SIG = ['void({0}[::1], {0}, {0}, {0}, {0}[::1], b1[::1])'
+                         .format(t) for t in _CHANNEL_TYPES]
+
+if njit is not None:
+    _cloud_confidence = njit(_CLOUD_CONFIDENCE_SIG, parallel=True,
+                             nogil=True, cache=True,
+                             error_model='numpy')(_cloud_confidence_loop)
+else:
+    _cloud_confidence = _cloud_confidence_numpy
+
+
+def cloud_confidence(diff, thres, ccr):
+    """Get cloud confidence level and cloud mask of the :class:`CloudFilter`.
+
+    Both are computed in one pass over the BT differences. The confidence
+    level is computed in the precision of the differences.
+
+    Args:
+        | diff (:obj:`ndarray`): Array of 10.8 - 3.9 μm BT differences.
+        | thres (:obj:`float`): Cloud filter BT difference threshold.
+        | ccr (:obj:`float`): Cloud confidence range in Kelvin.
+
+    Returns:
+        Cloud confidence level and cloud mask.
+    """
+    diff, = _as_channels(diff)
+    ccl = np.empty(diff.shape, dtype=diff.dtype)
+    mask = np.empty(diff.shape, dtype=bool)
+    _cloud_confidence(diff.ravel(), diff.dtype.type(thres),
+                      diff.dtype.type(ccr), diff.dtype.type(-2 * ccr),
+                      ccl.reshape(-1), mask.reshape(-1))
+
+    return ccl, mask
+
+
+def _histogram_loop(a, edges, hist):
+    """Count values in equal width bins, with the last bin edge included."""
+    nbins = hist.shape[0]
+    first = edges[0]
+    last = edges[nbins]
+    norm = nbins / (float(last) - float(first))
+    for k in range(a.shape[0]):
+        val = a[k]
+        if not (val >= first and val <= last):
+            continue
+        # Estimate bin from the bin width and correct it by the bin edges
+        idx = min(int((float(val) - float(first)) * norm), nbins - 1)
+        while idx > 0 and val < edges[idx]:
+            idx -= 1
+        while idx < nbins - 1 and val >= edges[idx + 1]:
+            idx += 1
+        hist[idx] += 1
+
+
+_HISTOGRAM_SIG = ['void({0}[::1], {0}[::1], intp[::1])'.format(t)
+                  for t in _CHANNEL_TYPES]
+
+if njit is not None:
+    _histogram = njit(_HISTOGRAM_SIG, nogil=True, cache=True,
+                      error_model='numpy')(_histogram_loop)
+else:
+    _histogram = None
+
+
+def histogram(a, bins='auto'):
+    """Compute the histogram of a data set in a single pass.
+
+    The bin edges are determined by :func:`numpy.histogram_bin_edges` and
+    the counts are the same as for :func:`numpy.histogram` with equal width
+    bins, which is used if numba is not available.
+
+    Args:
+        | a (:obj:`ndarray`): Input data, the histogram is computed over the
+                              flattened array.
+        | bins (:obj:`int` or :obj:`str`): Number of bins or name of the bin
+                                           width estimator.
+
+    Returns:
+        Histogram values and bin edges.
+    """
+    a = np.ravel(a)
+    if _histogram is None:
+        return np.histogram(a, bins=bins)
+    edges = np.histogram_bin_edges(a, bins=bins)
+    if a.dtype not in (np.float32, np.float64):
+        a = a.astype(np.float64)
+    a = np.ascontiguousarray(a)
+    edges = np.ascontiguousarray(edges, dtype=a.dtype)
+    hist = np.zeros(len(edges) - 1, dtype=np.intp)
+    _histogram(a, edges, hist)
+
+    return hist, edges
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017
+# Author(s):
+#   Thomas Leppelt <thomas.leppelt@dwd.de>
+
+# This file is part of the fogpy package.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module implements the fused fog masking kernel for CUDA GPUs
+
+The kernel requires numba with CUDA support and a CUDA capable device. Use
+:func:`is_available` to check for both before calling
+:func:`fog_mask_stages`.
+"""
+
+import logging
+import math
+import numpy as np
+
+from ._kernels import CLOUD_STAGE, SNOW_STAGE, ICE_STAGE, CIRRUS_STAGE
+from ._kernels import _snow_thres
+
+try:
+    from numba import cuda
+except ImportError:
+    cuda = None
+
+logger = logging.getLogger(__name__)
+
+# Number of threads per block in row and column direction
+BLOCK_SIZE = (16, 16)
+
+
+def _fog_mask_kernel(ir108, vis008, nir016, vis006, ir087, ir120, cloud_mask,
+                     cirrus_thres, snow_thres, stages):
+    """Snow, ice cloud and cirrus tests, one thread per pixel."""
+    i, j = cuda.grid(2)
+    if i < ir108.shape[0] and j < ir108.shape[1]:
+        bt108 = ir108[i, j]
+        # 1. Cloud test result of the cloud filter
+        cloud = cloud_mask[i, j]
+        # 2. Snow test
+        ndsi = ((vis006[i, j] - nir016[i, j]) /
+                (vis006[i, j] + nir016[i, j]))
+        snow = ((vis008[i, j] / snow_thres[0] >= snow_thres[1]) &
+                (bt108 >= 256) & (ndsi >= snow_thres[2]))
+        # 3. Ice cloud test
+        ice = (ir120[i, j] - ir087[i, j] < 2.5) | (bt108 < 250)
+        # 4. Thin and strong cirrus test
+        cirrus = ((bt108 - ir120[i, j] > cirrus_thres[i, j]) |
+                  (ir087[i, j] - bt108 > 0))
+        stages[i, j] = (cloud * CLOUD_STAGE | snow * SNOW_STAGE |
+                        ice * ICE_STAGE | cirrus * CIRRUS_STAGE)
+
+
+if cuda is not None:
+    fog_mask_kernel = cuda.jit(_fog_mask_kernel)
+else:
+    fog_mask_kernel = None
+
+
+def is_available():
+    """Check if the CUDA fog masking kernel can be used."""
+    return cuda is not None and cuda.is_available()
+
+
+def fog_mask_stages(ir108, vis008, nir016, vis006, ir087, ir120, cloud_mask,
+                    cirrus_thres, out=None):
+    """Apply the snow, ice cloud and thin cirrus tests on the GPU.
+
+    This is the GPU version of :func:`fogpy._kernels.fog_mask_stages`.
+    Host arrays are copied to the device on a separate stream and the
+    resulting stage codes are copied back. Device arrays, e.g. CuPy arrays,
+    are used directly and a device array is returned for them.
+
+    Args:
+        | ir108 (:obj:`ndarray`): Array for the 10.8 μm channel.
+        | vis008 (:obj:`ndarray`): Array for the 0.8 μm channel.
+        | nir016 (:obj:`ndarray`): Array for the 1.6 μm channel.
+        | vis006 (:obj:`ndarray`): Array for the 0.6 μm channel.
+        | ir087 (:obj:`ndarray`): Array for the 8.7 μm channel.
+        | ir120 (:obj:`ndarray`): Array for the 12.0 μm channel.
+        | cloud_mask (:obj:`ndarray`): Cloud mask of the cloud filter.
+        | cirrus_thres (:obj:`ndarray`): Cirrus BT difference thresholds.
+        | out (:obj:`ndarray`): Optional uint8 output array for the stage
+                                codes.
+
+    Returns:
+        Array of per pixel stage codes.
+    """
+    if not is_available():
+        raise RuntimeError("No CUDA device available for the fog mask kernel")
+    arrays = (ir108, vis008, nir016, vis006, ir087, ir120, cloud_mask,
+              cirrus_thres)
+    # Same check as cuda.is_cuda_array, which the CUDA simulator lacks
+    on_device = hasattr(ir108, '__cuda_array_interface__')
+    stream = cuda.stream()
+    if on_device:
+        d_arrays = [cuda.as_cuda_array(arr) for arr in arrays]
+    else:
+        d_arrays = [cuda.to_device(np.ascontiguousarray(np.ma.getdata(arr)),
+                                   stream=stream) for arr in arrays]
+    shape = d_arrays[0].shape
+    d_arrays.append(cuda.to_device(_snow_thres(d_arrays[0].dtype),
+                                   stream=stream))
+    d_stages = cuda.device_array(shape, dtype=np.uint8, stream=stream)
+    grid = (math.ceil(shape[0] / BLOCK_SIZE[0]),
+            math.ceil(shape[1] / BLOCK_SIZE[1]))
+    fog_mask_kernel[grid, BLOCK_SIZE, stream](*d_arrays, d_stages)
+    if on_device:
+        stream.synchronize()
+        return d_stages
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    d_stages.copy_to_host(out, stream=stream)
+    stream.synchronize()
+
+    return out
@@ -39,26 +39,27 @@ The implementation is based on the following publications:
 """
 
 import logging
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 
 from copy import deepcopy
 from datetime import datetime
+from operator import attrgetter
 from numpy.lib.stride_tricks import as_strided
 from scipy.ndimage import measurements
 from scipy.stats import linregress
 from scipy import interpolate
 from scipy import spatial
 from .filters import CloudFilter
-from .filters import SnowFilter
-from .filters import IceCloudFilter
 from .filters import CirrusCloudFilter
 from .filters import WaterCloudFilter
 from .filters import SpatialCloudTopHeightFilter
 from .filters import SpatialHomogeneityFilter
 from .filters import CloudPhysicsFilter
 from .filters import LowCloudFilter
+from .filters import MaskedView
+from .filters import _keep_channel_mask
+from ._kernels import fog_mask_stages, ICE_STAGE, CIRRUS_STAGE
 from pyresample import image, geometry
 from pyresample.utils import generate_nearest_neighbour_linesample_arrays
 
@@ -78,22 +79,40 @@ class DummyException(Exception):
 class BaseSatelliteAlgorithm(object):
     """This super filter class provide all functionalities to run an algorithm
     on satellite image arrays and return a new array as result."""
+    # Required inputs
+    attrlist = frozenset()
+    # Default floating point precision of the satellite channel arrays
+    precision = 'fp64'
+    # Name prefixes of satellite channel arrays
+    channel_prefixes = ('ir0', 'ir1', 'vis', 'nir')
+
     def __init__(self, **kwargs):
+        self.precision = kwargs.pop('precision', self.precision)
+        if self.precision not in ('fp32', 'fp64'):
+            raise ValueError("Unknown precision <{}>, use fp32 or fp64"
+                             .format(self.precision))
         self.mask = None
         self.result = None
-        self.attributes = []
-        if kwargs is not None:
-            for key, value in kwargs.items():
-                self.attributes.append(key)
-                if isinstance(value, np.ma.MaskedArray):
-                    self.add_mask(value.mask)
-                    value = self.check_dimension(value)
-                    self.shape = value.shape
-                elif isinstance(value, np.ndarray):
-                    value = self.check_dimension(value)
+        self.shape = None
+        self.attributes = list(kwargs)
+        masks = {}
+        for key, value in kwargs.items():
+            if isinstance(value, np.ndarray):
+                value = self.check_dimension(value)
+                mask = np.ma.getmask(value)
+                if mask is not np.ma.nomask:
+                    # Key on the mask buffer to merge shared masks once
+                    masks[(mask.__array_interface__['data'][0], mask.shape,
+                           mask.strides)] = mask
+                if (self.precision == 'fp32' and value.dtype == np.float64 and
+                        key[:3] in self.channel_prefixes):
+                    value = value.astype(np.float32)
+                if self.shape is None:
                     self.shape = value.shape
-
-                self.__setattr__(key, value)
+            self.__dict__[key] = value
+        # Merge the distinct input masks in one buffer
+        for mask in masks.values():
+            self.add_mask(mask)
         # Get class name
         self.name = self.__str__().split(' ')[0].split('.')[-1]
         # Set plotting attribute
@@ -122,15 +141,17 @@ class BaseSatelliteAlgorithm(object):
 
     def isprocessible(self):
         """Test runability here"""
-        ret = True
+        missing = self.attrlist.difference(self.__dict__)
+        if missing:
+            logger.warning("Missing input attributes: {}"
+                           .format(", ".join(sorted(missing))))
 
-        return(ret)
+        return not missing
 
     def procedure(self):
         """Define algorithm procedure here"""
-        self.mask = np.ones(self.shape) == 1
-
-        self.result = np.ma.array(np.ones(self.shape), mask=self.mask)
+        self.result = np.ma.masked_all(self.shape, dtype=np.float32)
+        self.mask = self.result.mask
 
         return True
 
@@ -142,13 +163,26 @@ class BaseSatelliteAlgorithm(object):
 
     def add_mask(self, mask):
         """Compute the new array mask as union of all input array masks
-        and computed masks."""
+        and computed masks.
+
+        The first mask is copied into an algorithm owned buffer, all further
+        masks are merged into this buffer in place to avoid a new full size
+        array for every union. Empty masks (nomask) are skipped.
+        """
+        if mask is np.ma.nomask or mask is False:
+            return
         if not np.ma.is_mask(mask):
             raise TypeError("Mask type is invalid")
-        if self.mask is not None:
-            self.mask = self.mask | mask
+        mask = np.ma.getdata(mask)
+        if mask.ndim == 0 and not mask:
+            return
+        if self.mask is None:
+            self.mask = np.array(mask, dtype=bool)
+        elif (np.shape(self.mask) == np.broadcast(self.mask, mask).shape and
+              self.mask.flags.writeable):
+            np.logical_or(self.mask, mask, out=self.mask)
         else:
-            self.mask = mask
+            self.mask = self.mask | mask
 
     def get_kwargs(self, keys):
         """Return dictionary with passed keyword arguments."""
@@ -282,6 +316,7 @@ class BaseSatelliteAlgorithm(object):
                     title='Regression plot'):
         """ Plot result of linear regression for DEM and lapse rate extracted
         low cloud top height and cloud top temperatures."""
+        import matplotlib.pyplot as plt
         plt.plot(x, y, '.')
         plt.plot(x, m * x + c)
         plt.title(title)
@@ -339,6 +374,10 @@ class DayFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
         | cot (:obj:`ndarray`): Array of cloud optical thickness (depth).
         | reff (:obj:`ndarray`): Array of cloud particle effective radius.
         | lwp (:obj:`ndarray`): Array of cloud liquid water path.
+        | precision (:obj:`str`): Floating point precision of the channel
+                                  arrays, fp32 (default) or fp64.
+        | gpu (:obj:`bool`): Run the fused cloud, snow, ice and cirrus
+                             masking on a CUDA device if available.
 
     Returns:
         Infrared image with fog mask
@@ -372,70 +411,106 @@ class DayFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
         12.  Fog Nowcasting                          No
         ============================================ =====================
      """
+    # Required inputs
+    attrlist = frozenset(['ir108', 'ir039', 'vis008', 'nir016', 'vis006',
+                          'ir087', 'ir120', 'lat', 'lon', 'time', 'elev',
+                          'cot', 'lwp', 'reff'])
+    # Channel arrays are processed in single precision by default
+    precision = 'fp32'
+    # Channel arrays of the fused cloud, snow, ice cloud and cirrus filters
+    channel_names = ('ir108', 'ir039', 'vis008', 'nir016', 'vis006', 'ir087',
+                     'ir120')
+    # Input attributes of the applied filters
+    _FILTER_INPUTS = {
+        'cloud': ('ir108', 'ir039', 'time', 'save', 'resize', 'plot', 'dir'),
+        'cirrus': ('ir120', 'ir087', 'ir108', 'lat', 'lon', 'time', 'save',
+                   'resize', 'plot', 'dir'),
+        'water': ('ir108', 'vis008', 'nir016', 'vis006', 'ir039', 'time',
+                  'save', 'resize', 'plot', 'dir'),
+        'cth': ('ir108', 'elev', 'time', 'dir', 'plot', 'save'),
+        'physic': ('cot', 'reff', 'time', 'save', 'resize', 'plot', 'dir'),
+        'lowcloud': ('ir108', 'lwp', 'reff', 'elev', 'time', 'save',
+                     'resize', 'plot', 'dir'),
+    }
+    _FILTER_GETTERS = {name: attrgetter(*keys)
+                       for name, keys in _FILTER_INPUTS.items()}
+
     def __init__(self, *args, **kwargs):
         super(DayFogLowStratusAlgorithm, self).__init__(*args, **kwargs)
         # Set additional class attribute
         if not hasattr(self, 'single'):
             self.single = False
+        if not hasattr(self, 'gpu'):
+            self.gpu = False
 
-    def isprocessible(self):
-        """Test runability here"""
-        attrlist = ['ir108', 'ir039', 'vis008', 'nir016', 'vis006', 'ir087',
-                    'ir120', 'lat', 'lon', 'time', 'elev', 'lwp', 'reff']
-        ret = []
-        for attr in attrlist:
-            if hasattr(self, attr):
-                ret.append(True)
-            else:
-                ret.append(False)
-                logger.warning("Missing input attribute: {}".format(attr))
+    def apply_prefilters(self):
+        """Apply the cloud, snow, ice cloud and thin cirrus filters.
 
-        return all(ret)
+        The cloud filter is applied first, because it derives its threshold
+        from the histogram of the whole scene. The snow, ice cloud and thin
+        cirrus tests are then fused with its cloud mask in a single pass over
+        the channel data. The per pixel test results are stored as bit codes
+        in :attr:`stage_mask` and the combined mask is added to the algorithm
+        mask.
 
-    def procedure(self):
-        """ Apply different filters and low cloud model to input data."""
-        logger.info("Starting fog and low cloud detection algorithm"
-                    " in daytime mode")
+        Returns: Cloud filter and the 10.8 μm channel data with the combined
+        filter mask
+        """
         # 1. Cloud filtering
-        cloud_input = self.get_kwargs(['ir108', 'ir039', 'time', 'save',
-                                       'resize', 'plot', 'dir'])
-        cloudfilter = CloudFilter(cloud_input['ir108'], bg_img=self.ir108,
+        cloud_input = self._get_filter_input('cloud')
+        cloudfilter = CloudFilter(self.ir108, bg_img=self.ir108,
                                   **cloud_input)
         cloudfilter.apply()
-        self.add_mask(cloudfilter.mask)
 
-        # 2. Snow filtering
-        snow_input = self.get_kwargs(['ir108', 'vis008', 'nir016', 'vis006',
-                                      'time', 'save', 'resize', 'plot', 'dir'])
-        snowfilter = SnowFilter(cloudfilter.result, bg_img=self.ir108,
-                                **snow_input)
-        snowfilter.apply()
-        self.add_mask(snowfilter.mask)
-
-        # 3. Ice cloud detection
+        # 2. - 4. Snow, ice cloud and thin cirrus filtering
         # Ice cloud exclusion - Only warm fog (i.e. clouds in the water phase)
         # are considered. Warning: No ice fog detection with this filter option
-        ice_input = self.get_kwargs(['ir120', 'ir087', 'ir108', 'time', 'save',
-                                     'resize', 'plot', 'dir'])
-        icefilter = IceCloudFilter(snowfilter.result, bg_img=self.ir108,
-                                   **ice_input)
-        icefilter.apply()
-        self.add_mask(icefilter.mask)
-
-        # 4. Cirrus cloud filtering
-        cirrus_input = self.get_kwargs(['ir120', 'ir087', 'ir108', 'lat',
-                                        'lon', 'time', 'save', 'resize',
-                                        'plot', 'dir'])
-        cirrusfilter = CirrusCloudFilter(icefilter.result, bg_img=self.ir108,
+        # Only the cirrus thresholds are derived beforehand.
+        cirrus_input = self._get_filter_input('cirrus')
+        cirrusfilter = CirrusCloudFilter(self.ir108, bg_img=self.ir108,
                                          **cirrus_input)
-        cirrusfilter.apply()
-        self.add_mask(cirrusfilter.mask)
+        get_stages = fog_mask_stages
+        if self.gpu:
+            # Import CUDA support only on request
+            from . import _kernels_cuda
+            if _kernels_cuda.is_available():
+                get_stages = _kernels_cuda.fog_mask_stages
+            else:
+                logger.warning("No CUDA device available, applying the "
+                               "filters on the CPU")
+        # Per pixel bit codes of the tests that masked the pixel
+        self.stage_mask = get_stages(
+            self.ir108, self.vis008, self.nir016, self.vis006, self.ir087,
+            self.ir120, cloudfilter.mask, cirrusfilter.get_bt_thres())
+        # Masked channel values are excluded like in the single filters
+        prefilter_mask = self.stage_mask != 0
+        for name in self.channel_names:
+            chn_mask = np.ma.getmask(getattr(self, name))
+            if chn_mask is not np.ma.nomask:
+                prefilter_mask |= chn_mask
+        self.add_mask(prefilter_mask)
+        vcloudmask = (self.stage_mask & (ICE_STAGE | CIRRUS_STAGE)) != 0
+        self.vcloudmask = _keep_channel_mask(vcloudmask, self.ir108,
+                                             self.ir087, self.ir120)
+
+        return cloudfilter, MaskedView(np.ma.getdata(self.ir108),
+                                       prefilter_mask)
+
+    def _get_filter_input(self, name):
+        """Return keyword arguments for the given filter."""
+        return dict(zip(self._FILTER_INPUTS[name],
+                        self._FILTER_GETTERS[name](self)))
+
+    def procedure(self):
+        """ Apply different filters and low cloud model to input data."""
+        logger.info("Starting fog and low cloud detection algorithm"
+                    " in daytime mode")
+        # 1. - 4. Cloud, snow, ice cloud and thin cirrus filtering
+        cloudfilter, stage_view = self.apply_prefilters()
 
         # 5. Water cloud filtering
-        water_input = self.get_kwargs(['ir108', 'vis008', 'nir016', 'vis006',
-                                       'ir039', 'time', 'save', 'resize',
-                                       'plot', 'dir'])
-        waterfilter = WaterCloudFilter(cirrusfilter.result,
+        water_input = self._get_filter_input('water')
+        waterfilter = WaterCloudFilter(stage_view,
                                        cloudmask=cloudfilter.mask,
                                        bg_img=self.ir108,
                                        **water_input)
@@ -449,8 +524,7 @@ class DayFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
 
         # 7. Calculate cloud top height if no CTH array is given
         if not hasattr(self, 'cth') or self.cth is None:
-            cth_input = self.get_kwargs(['ir108', 'elev', 'time', 'dir',
-                                         'plot', 'save'])
+            cth_input = self._get_filter_input('cth')
             cth_input['ccl'] = cloudfilter.ccl
             cth_input['cloudmask'] = self.mask
             cth_input['interpolate'] = True
@@ -490,8 +564,7 @@ class DayFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
         self.add_mask(stdevfilter.mask)
 
         # 9. Apply cloud microphysical filter
-        physic_input = self.get_kwargs(['cot', 'reff', 'time', 'save',
-                                        'resize', 'plot', 'dir'])
+        physic_input = self._get_filter_input('physic')
         physicfilter = CloudPhysicsFilter(stdevfilter.result,
                                           bg_img=self.ir108,
                                           **physic_input)
@@ -502,9 +575,7 @@ class DayFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
         # Recalculate clusters
         self.clusters = self.get_cloud_cluster(self.mask)
         # Run low cloud model
-        lowcloud_input = self.get_kwargs(['ir108', 'lwp', 'reff', 'elev',
-                                          'time', 'save', 'resize', 'plot',
-                                          'dir'])
+        lowcloud_input = self._get_filter_input('lowcloud')
         # Choose cluster computation method
         lowcloud_input['single'] = self.single
 
@@ -521,8 +592,6 @@ class DayFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
         self.mask = self.mask
 
         # Compute separate products for validaiton
-        # Get cloud mask
-        self.vcloudmask = icefilter.mask | cirrusfilter.mask
         # Extract cloud base and top heights products
         self.cbh = lowcloudfilter.cbh  # Cloud base height
         self.fbh = lowcloudfilter.fbh  # Fog base height
@@ -630,6 +699,9 @@ class LowCloudHeightAlgorithm(BaseSatelliteAlgorithm):
     Returns:
         Array with cloud top heights in [m]
     """
+    # Required inputs
+    attrlist = frozenset(['ir108', 'cloudmask', 'ccl', 'elev'])
+
     def __init__(self, *args, **kwargs):
         super(LowCloudHeightAlgorithm, self).__init__(*args, **kwargs)
         # Set additional class attribute
@@ -643,19 +715,6 @@ class LowCloudHeightAlgorithm(BaseSatelliteAlgorithm):
             self.plottype = 'png'
         self.nlcthneg = 0
 
-    def isprocessible(self):
-        """Test runability here"""
-        attrlist = ['ir108', 'cloudmask', 'ccl', 'elev']
-        ret = []
-        for attr in attrlist:
-            if hasattr(self, attr):
-                ret.append(True)
-            else:
-                ret.append(False)
-                logger.warning("Missing input attribute: {}".format(attr))
-
-        return all(ret)
-
     def procedure(self):
         """ Apply low cloud height algorithm to input arrays."""
         logger.info("Starting low cloud height assignment algorithm")
@@ -855,17 +914,16 @@ class LowCloudHeightAlgorithm(BaseSatelliteAlgorithm):
         if j_max >= shp[1]:
             j_max = shp[1]
         # Copy array slice and convert to float type for Nan value support
-        neighbors = np.copy(arr[i_min:i_max, j_min:j_max].astype(float))
+        neighbors = np.array(arr[i_min:i_max, j_min:j_max], dtype=float)
         center = arr[i, j]
         neighbors[i - i_min, j - j_min] = np.nan
         if mask is not None:
             neighbors[mask] = np.nan
         # Create valid neighbor mask
-        ids = np.zeros(neighbors.shape).astype(bool)
-        ids[np.isnan(neighbors)] = True
+        ids = np.isnan(neighbors)
         # Return optional only non nan values
         if not nan:
-            return center, neighbors[~np.isnan(neighbors)], ids
+            return center, neighbors[~ids], ids
         else:
             # deselect center from neighbors; for not-nan case this is already
             # taken care of by defining centre as nan
@@ -1173,7 +1231,7 @@ class PanSharpeningAlgorithm(BaseSatelliteAlgorithm):
             if self.method == 'hill':
                 self.apply_hill_sharpening(chn, panrow, pancol, panshrp_chn)
         # Set results
-        self.mask = np.zeros(self.pan_degrad.shape)
+        self.mask = np.zeros(self.pan_degrad.shape, dtype=bool)
 
         return True
 
@@ -1324,6 +1382,7 @@ class PanSharpeningAlgorithm(BaseSatelliteAlgorithm):
         return np.histogram(v)
 
     def plot_bt_hist(self, hist, saveto=None):
+        import matplotlib.pyplot as plt
         plt.bar(hist[1][:-1], hist[0])
         plt.title("Histogram with 'auto' bins")
         if saveto is None:
@@ -1332,6 +1391,7 @@ class PanSharpeningAlgorithm(BaseSatelliteAlgorithm):
             plt.savefig(saveto)
 
     def plot_thres(self, saveto=None):
+        import matplotlib.pyplot as plt
         plt.plot(self.sza, self.thres, 'ro')
         if self.slope and self.intercept:
             plt.plot(self.sza, self.slope * self.sza + self.intercept, 'b-')
@@ -1432,6 +1492,11 @@ class NightFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
         5.  Derive confidence level                  yes
         ============================================ =====================
      """
+    # Required inputs
+    attrlist = frozenset(['ir108', 'ir039', 'lat', 'lon', 'time', 'sza'])
+    # Channel arrays are processed in single precision by default
+    precision = 'fp32'
+
     def __init__(self, *args, **kwargs):
         super(NightFogLowStratusAlgorithm, self).__init__(*args, **kwargs)
         # Set additional class attribute
@@ -1442,19 +1507,6 @@ class NightFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
         if not hasattr(self, 'fcr'):
             self.fcr = 2  # Fog confidence range in K
 
-    def isprocessible(self):
-        """Test runability here."""
-        attrlist = ['ir108', 'ir039', 'lat', 'lon', 'time', 'sza']
-        ret = []
-        for attr in attrlist:
-            if hasattr(self, attr):
-                ret.append(True)
-            else:
-                ret.append(False)
-                logger.warning("Missing input attribute: {}".format(attr))
-
-        return all(ret)
-
     def procedure(self):
         """ Run nighttime fog and low stratus detection scheme."""
         logger.info("Starting fog and low cloud detection algorithm"
@@ -1592,6 +1644,7 @@ class NightFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
 
     def plot_bt_hist(self, hist, saveto=None):
         """Plot histogram of temperature distribution."""
+        import matplotlib.pyplot as plt
         plt.bar(hist[1][:-1], hist[0])
         plt.title("Histogram with 'auto' bins")
         if saveto is None:
@@ -1601,6 +1654,7 @@ class NightFogLowStratusAlgorithm(BaseSatelliteAlgorithm):
 
     def plot_thres(self, saveto=None):
         """Potting of satellite-zenith-angles specific thresholds."""
+        import matplotlib.pyplot as plt
         plt.plot(self.sza, self.thres, 'ro')
         if self.slope and self.intercept:
             plt.plot(self.sza, self.slope * self.sza + self.intercept, 'b-')
@@ -22,38 +22,81 @@
 """This module implements an basic algorithm filter class
 and several class instances for satellite fog detection applications"""
 
-import copyreg
+import atexit
 import logging
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-import time
-import types
 
 from copy import deepcopy
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from matplotlib.cm import get_cmap
+from functools import reduce
 import multiprocessing as mp
 from pyorbital import astronomy
 from scipy.signal import find_peaks_cwt
 from scipy import ndimage
+from ._kernels import (cirrus_mask, cloud_confidence, histogram, ice_mask,
+                       snow_mask)
 from .lowwatercloud import LowWaterCloud
 from .utils.import_synop import read_synop
 
 logger = logging.getLogger(__name__)
 
+# Default number of processes for the filters
+_NPROCS = mp.cpu_count()
 
-# Add new pickle method, required for multiprocessing to run class instance
-# methods in parallel
-def _pickle_method(m):
-    if m.im_self is None:
-        return getattr, (m.im_class, m.im_func.func_name)
-    else:
-        return getattr, (m.im_self, m.im_func.func_name)
 
+# Process pool for the low cloud models, kept between filter runs
+_executor = None
+_executor_workers = None
 
-copyreg.pickle(types.MethodType, _pickle_method)
+
+def _shutdown_executor():
+    """Shut down the shared process pool if it is running."""
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown()
+    _executor = None
+    _executor_workers = None
+
+
+atexit.register(_shutdown_executor)
+
+
+def _get_executor(max_workers):
+    """Get the shared process pool with the given number of workers.
+
+    The workers are forked where possible, so that scripts without a main
+    guard can run the filters.
+    """
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != max_workers:
+        _shutdown_executor()
+        if 'fork' in mp.get_all_start_methods():
+            context = mp.get_context('fork')
+        else:
+            context = mp.get_context()
+        _executor = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=context)
+        _executor_workers = max_workers
+
+    return _executor
+
+
+# Plain data and boolean mask pair, passed between array kernels instead of a
+# masked array
+MaskedView = namedtuple('MaskedView', ['data', 'mask'])
+
+
+def _keep_channel_mask(mask, *channels):
+    """Mask the kernel mask where any masked channel array is masked."""
+    chn_mask = reduce(np.ma.mask_or, [np.ma.getmask(chn) for chn in channels])
+    if chn_mask is np.ma.nomask:
+        return mask
+
+    return np.ma.masked_array(mask, chn_mask)
 
 
 class NotApplicableError(Exception):
@@ -70,9 +113,14 @@ class BaseArrayFilter(object):
     """This super filter class provide all functionalities to apply a filter
     funciton on a given numpy array representing a satellite image and return
     the filtered masked array as result."""
+    # Filter reference time, set to the current time on first use
+    _time = None
+
     def __init__(self, arr, **kwargs):
         if isinstance(arr, np.ma.MaskedArray):
             self.arr = arr
+        elif isinstance(arr, MaskedView):
+            self.arr = np.ma.masked_array(arr.data, arr.mask)
         elif isinstance(arr, np.ndarray):
             self.arr = np.ma.masked_array(arr, np.zeros_like(arr))
         else:
@@ -86,11 +134,6 @@ class BaseArrayFilter(object):
             self.mask = None
         # Get class name
         self.name = self.__str__().split(' ')[0].split('.')[-1]
-        # Set time
-        if not hasattr(self, 'time'):
-            self.time = datetime.now()
-            logger.debug('Setting filter reference time to current time: {}'
-                         .format(self.time))
         # Set plotting attribute
         if not hasattr(self, 'save'):
             self.save = False
@@ -104,10 +147,27 @@ class BaseArrayFilter(object):
             self.resize = 0
         # Get number of cores
         if not hasattr(self, 'nprocs'):
-            self.nprocs = mp.cpu_count()
+            self.nprocs = _NPROCS
         # Get attribute names for plotting
         if not hasattr(self, 'plotattr'):
             self.plotattr = None
+        # Compute and log filter statistics
+        if not hasattr(self, 'stats'):
+            self.stats = True
+
+    @property
+    def time(self):
+        """Filter reference time getter method."""
+        if self._time is None:
+            self._time = datetime.now()
+            logger.debug('Setting filter reference time to current time: {}'
+                         .format(self._time))
+        return self._time
+
+    @time.setter
+    def time(self, value):
+        """Filter reference time setter method."""
+        self._time = value
 
     @property
     def mask(self):
@@ -152,7 +212,7 @@ class BaseArrayFilter(object):
 
     def filter_function(self):
         """Filter routine"""
-        self.mask = np.ones(self.arr.shape) == 1
+        self.mask = np.ones(self.arr.shape, dtype=bool)
 
         self.result = np.ma.array(self.arr, mask=self.mask)
 
@@ -160,7 +220,8 @@ class BaseArrayFilter(object):
 
     def check_results(self):
         """Check filter results for plausible results."""
-        self.filter_stats()
+        if self.stats:
+            self.filter_stats()
         if self.plot:
             self.plot_filter(self.save, self.dir, self.resize,
                              attr=self.plotattr)
@@ -168,16 +229,20 @@ class BaseArrayFilter(object):
         return ret
 
     def filter_stats(self):
-        self.filter_size = self.mask.size
-        self.filter_num = np.nansum(self.mask)
+        # Masked values of the filter mask are not counted
+        mask = np.ma.filled(self.mask, False)
+        self.filter_size = mask.size
+        self.filter_num = np.count_nonzero(mask)
         if self.inmask is None:
             self.inmask_num = 0
             self.new_masked = self.filter_num
             self.remain_num = self.filter_size - self.filter_num
         else:
-            self.inmask_num = np.nansum(self.inmask)
-            self.new_masked = np.nansum(~self.inmask & self.mask)
-            self.remain_num = np.nansum(~self.mask & ~self.inmask)
+            self.inmask_num = np.count_nonzero(self.inmask)
+            both_num = np.count_nonzero(mask & self.inmask)
+            self.new_masked = self.filter_num - both_num
+            self.remain_num = (self.filter_size - self.filter_num -
+                               self.inmask_num + both_num)
 
         logger.info("""Filter results for {} \n
                     {}
@@ -219,6 +284,8 @@ class BaseArrayFilter(object):
             from trollimage.colormap import Colormap
             from mpop.imageo.geo_image import GeoImage
         except ImportError:
+            import matplotlib.pyplot as plt
+            from matplotlib.cm import get_cmap
             cmap = get_cmap('gray')
             cmap.set_bad('goldenrod', 1.)
             plt.imshow(self.result.squeeze())
@@ -406,8 +473,13 @@ class CloudFilter(BaseArrayFilter):
         # Infrared channel difference
         self.cm_diff = np.ma.asarray(self.ir108 - self.ir039)
 
-        # Create histogram
-        self.hist = (np.histogram(self.cm_diff.compressed(), bins='auto'))
+        # Create histogram of valid differences, skipping masked and nan
+        # values in one selection
+        diff = np.ma.getdata(self.cm_diff)
+        valid = np.isfinite(diff)
+        if self.cm_diff.mask is not np.ma.nomask:
+            valid &= ~self.cm_diff.mask
+        self.hist = histogram(diff[valid], bins='auto')
 
         # Find local min and max values
         peaks = np.sign(np.diff(self.hist[0]))
@@ -446,14 +518,13 @@ class CloudFilter(BaseArrayFilter):
         else:
             logger.debug("Cloud mask difference threshold set to {}"
                          .format(self.thres))
-        # Compute cloud confidence level
-        self.ccl = (self.cm_diff - self.thres - self.ccr) / (-2 * self.ccr)
-        # Limit range to 0 (cloudfree) and 1 (cloudy)
-        self.ccl[self.ccl > 1] = 1
-        self.ccl[self.ccl < 0] = 0
+        # Compute cloud confidence level, limited to the range from 0
+        # (cloudfree) to 1 (cloudy), and the cloud mask in one pass
+        ccl, mask = cloud_confidence(self.cm_diff, self.thres, self.ccr)
+        self.ccl = np.ma.masked_array(ccl, np.ma.getmask(self.cm_diff))
 
         # Create cloud mask for image array
-        self.mask = self.cm_diff > self.thres
+        self.mask = _keep_channel_mask(mask, self.cm_diff)
 
         self.result = np.ma.array(self.arr, mask=self.mask)
 
@@ -461,6 +532,7 @@ class CloudFilter(BaseArrayFilter):
 
     def plot_cloud_hist(self, saveto=None):
         """Plot the histogram of brightness temperature differences."""
+        import matplotlib.pyplot as plt
         plt.bar(self.hist[1][:-1], self.hist[0])
         plt.title("Histogram with 'auto' bins")
         if saveto is None:
@@ -486,6 +558,8 @@ class SnowFilter(BaseArrayFilter):
     """Snow filtering for satellite images."""
     # Required inputs
     attrlist = ['vis006', 'vis008', 'nir016', 'ir108']
+    # Normalized Difference Snow Index, only calculated if requested
+    _ndsi = None
 
     def filter_function(self):
         """Snow filter routine
@@ -508,21 +582,25 @@ class SnowFilter(BaseArrayFilter):
             Filter image and filter mask.
         """
         logger.info("Applying Snow Filter")
-        # Calculate Normalized Difference Snow Index
-        self.ndsi = (self.vis006 - self.nir016) / (self.vis006 + self.nir016)
-
         # Where the NDSI exceeds a certain threshold (0.4) and the two other
         # criteria are met, a pixel is rejected as snow-covered.
+        mask = snow_mask(self.vis006, self.vis008, self.nir016, self.ir108)
         # Create snow mask for image array
-        temp_thres = (self.vis008 / 100 >= 0.11) & (self.ir108 >= 256)
-        ndsi_thres = self.ndsi >= 0.4
-        # Create snow mask for image array
-        self.mask = temp_thres & ndsi_thres
+        self.mask = _keep_channel_mask(mask, self.vis006, self.vis008,
+                                       self.nir016, self.ir108)
 
         self.result = np.ma.array(self.arr, mask=self.mask)
 
         return True
 
+    @property
+    def ndsi(self):
+        """Normalized Difference Snow Index, calculated on first access."""
+        if self._ndsi is None:
+            self._ndsi = ((self.vis006 - self.nir016) /
+                          (self.vis006 + self.nir016))
+        return self._ndsi
+
 
 class IceCloudFilter(BaseArrayFilter):
     """Ice cloud filtering for satellite images."""
@@ -548,17 +626,40 @@ class IceCloudFilter(BaseArrayFilter):
             Filter image and filter mask.
         """
         logger.info("Applying Snow Filter")
-        # Apply infrared channel difference
-        self.ic_diff = self.ir120 - self.ir087
-        # Create ice cloud mask
-        ice_mask = (self.ic_diff < 2.5) | (self.ir108 < 250)
+        # Create ice cloud mask from infrared channel difference
+        mask = ice_mask(self.ir120, self.ir087, self.ir108)
         # Create snow mask for image array
-        self.mask = ice_mask
+        self.mask = _keep_channel_mask(mask, self.ir120, self.ir087,
+                                       self.ir108)
 
         self.result = np.ma.array(self.arr, mask=self.mask)
 
         return True
 
+    @property
+    def ic_diff(self):
+        """Infrared channel difference, calculated on access."""
+        return self.ir120 - self.ir087
+
+
+def _lut_to_array(lut):
+    """Convert nested lookup table dictionary to key and value arrays."""
+    row_keys = np.array(sorted(lut))
+    col_keys = np.array(sorted(lut[row_keys[0]]))
+    values = np.array([[lut[row][col] for col in col_keys]
+                       for row in row_keys])
+
+    return row_keys, col_keys, values
+
+
+def _nearest_index(values, keys):
+    """Get index of nearest sorted key for values, lower key for ties."""
+    idx = np.searchsorted((keys[1:] + keys[:-1]) / 2, values)
+    # Invalid values are assigned to the first key
+    idx[np.isnan(values)] = 0
+
+    return idx
+
 
 class CirrusCloudFilter(BaseArrayFilter):
     """Thin cirrus cloud filtering for satellite images."""
@@ -590,8 +691,45 @@ class CirrusCloudFilter(BaseArrayFilter):
             Filter image and filter mask.
         """
         logger.info("Applying Cirrus Filter")
-        # Get infrared channel difference
-        self.bt_diff = self.ir108 - self.ir120
+        # Get BT difference thresholds from lookup table
+        self.bt_thres = self.get_bt_thres()
+        # Thin and strong cirrus test
+        mask = cirrus_mask(self.ir108, self.ir087, self.ir120, self.bt_thres)
+
+        # Create snow mask for image array
+        self.mask = _keep_channel_mask(mask, self.ir108, self.ir087,
+                                       self.ir120)
+
+        self.result = np.ma.array(self.arr, mask=self.mask)
+
+        return True
+
+    @property
+    def bt_diff(self):
+        """Split window BT difference, calculated on access."""
+        return self.ir108 - self.ir120
+
+    @property
+    def bt_ci_mask(self):
+        """Thin cirrus mask, calculated on access."""
+        return self.bt_diff > self.bt_thres
+
+    @property
+    def strong_ci_diff(self):
+        """Strong cirrus BT difference, calculated on access."""
+        return self.ir087 - self.ir108
+
+    @property
+    def strong_ci_mask(self):
+        """Strong cirrus mask, calculated on access."""
+        return self.strong_ci_diff > 0
+
+    def get_bt_thres(self):
+        """Get BT difference thresholds for the thin cirrus test.
+
+        The thresholds are taken from the lookup table for the nearest
+        secant of the sun zenith angle and 10.8 μm BT values.
+        """
         # Calculate sun zenith angles
         sza = astronomy.sun_zenith_angle(self.time, self.lon, self.lat)
         minsza = np.min(sza)
@@ -601,48 +739,15 @@ class CirrusCloudFilter(BaseArrayFilter):
         # Calculate secant of sza
         secsza = 1 / np.cos(np.deg2rad(sza))
 
-        # Apply lut to BT and sza values
-        # Vectorize LUT functions for numpy arrays
-        vfind_nearest_lut_sza = np.vectorize(self.find_nearest_lut_sza)
-        vfind_nearest_lut_bt = np.vectorize(self.find_nearest_lut_bt)
-        vapply_lut = np.vectorize(self.apply_lut)
-
-        secsza_lut = vfind_nearest_lut_sza(secsza)
-        chn108_ma_lut = vfind_nearest_lut_bt(self.ir108)
-
-        self.bt_thres = vapply_lut(secsza_lut, chn108_ma_lut)
+        # Apply lut to nearest BT and sza values
+        bt_idx = _nearest_index(np.ma.getdata(self.ir108), self.lut_bt)
+        sza_idx = _nearest_index(np.ma.getdata(secsza), self.lut_sza)
+        bt_thres = self.lut_thres[bt_idx, sza_idx]
         logger.debug("Set BT difference thresholds for cirrus: {} to {} K"
-                     .format(np.min(self.bt_thres), np.max(self.bt_thres)))
-        # Create thin cirrus mask
-        self.bt_ci_mask = self.bt_diff > self.bt_thres
+                     .format(np.min(bt_thres), np.max(bt_thres)))
 
-        # Strong cirrus test
-        self.strong_ci_diff = self.ir087 - self.ir108
-        self.strong_ci_mask = self.strong_ci_diff > 0
-        cirrus_mask = self.bt_ci_mask | self.strong_ci_mask
+        return bt_thres
 
-        # Create snow mask for image array
-        self.mask = cirrus_mask
-
-        self.result = np.ma.array(self.arr, mask=self.mask)
-
-        return True
-
-    def find_nearest_lut_sza(self, sza):
-        """ Get nearest look up table key value for given ssec(sza)."""
-        sza_opt = [1.0, 1.25, 1.50, 1.75, 2.0]
-        sza_idx = np.array([np.abs(sza - i) for i in sza_opt]).argmin()
-        return(sza_opt[sza_idx])
-
-    def find_nearest_lut_bt(self, bt):
-        """ Get nearest look up table key value for given BT."""
-        bt_opt = [260, 270, 280, 290, 300, 310]
-        bt_idx = np.array([np.abs(bt - i) for i in bt_opt]).argmin()
-        return(bt_opt[bt_idx])
-
-    def apply_lut(self, sza, bt):
-        """ Apply LUT to given BT and sza values."""
-        return(self.lut[bt][sza])
     # Lookup table for BT difference thresholds at certain sec(sun zenith
     # angles) and 10.8 μm BT
     lut = {260: {1.0: 0.55, 1.25: 0.60, 1.50: 0.65, 1.75: 0.90, 2.0: 1.10},
@@ -651,6 +756,9 @@ class CirrusCloudFilter(BaseArrayFilter):
            290: {1.0: 3.06, 1.25: 3.72, 1.50: 3.95, 1.75: 4.27, 2.0: 4.73},
            300: {1.0: 5.77, 1.25: 6.92, 1.50: 7.00, 1.75: 7.42, 2.0: 8.43},
            310: {1.0: 9.41, 1.25: 11.22, 1.50: 11.03, 1.75: 11.60, 2.0: 13.39}}
+    # Lookup table as array with 10.8 μm BT keys in rows and sec(sza) keys in
+    # columns
+    lut_bt, lut_sza, lut_thres = _lut_to_array(lut)
 
 
 class WaterCloudFilter(BaseArrayFilter):
@@ -692,10 +800,12 @@ class WaterCloudFilter(BaseArrayFilter):
         self.lat_cloudfree = np.ma.mean(cloud_free_ma, 1)
         logger.debug("Mean latitudinal threshold for cloudfree areas: %.2f K"
                      % np.mean(self.lat_cloudfree))
-        self.line = 0
-        # Apply latitudinal threshold to cloudy areas
-        drop_mask = np.apply_along_axis(self.find_watercloud, 1, self.ir039,
-                                        self.lat_cloudfree)
+        # Apply latitudinal threshold to cloudy areas. The mean threshold is
+        # used for rows without cloud free pixels
+        thres = self.lat_cloudfree.filled(np.ma.mean(self.lat_cloudfree))
+        drop_mask = np.ma.getdata(self.ir039) <= np.expand_dims(thres, 1)
+        # Masked pixels are flagged, including rows without valid pixels
+        drop_mask |= np.ma.getmaskarray(self.ir039)
 
         # Create snow mask for image array
         self.mask = water_mask | drop_mask
@@ -704,20 +814,6 @@ class WaterCloudFilter(BaseArrayFilter):
 
         return True
 
-    def find_watercloud(self, lat, thres):
-        """Funciton to compare row of BT with given latitudinal thresholds"""
-        if not isinstance(lat, np.ma.masked_array):
-            lat = np.ma.MaskedArray(lat, mask=np.zeros(lat.shape))
-        if all(lat.mask):
-            res = lat.mask
-        elif np.ma.is_masked(thres[self.line]):
-            res = lat <= np.mean(self.lat_cloudfree)
-        else:
-            res = lat <= thres[self.line]
-        self.line += 1
-
-        return(res)
-
 
 class SpatialCloudTopHeightFilter_old(BaseArrayFilter):
     """Filtering cloud clusters by height for satellite images."""
@@ -733,16 +829,27 @@ class SpatialCloudTopHeightFilter_old(BaseArrayFilter):
         """
         logger.info("Applying Spatial Clustering Cloud Top Height Filter")
         # Apply maximum threshold for cluster height to identify low fog clouds
-        cluster_mask = self.clusters.mask
+        # Lookup tables of high clusters and cluster values by cluster label
+        labels = self.clusters.filled(0).astype(np.intp, copy=False)
+        nlut = max([labels.max()] + list(self.cluster_z.keys())) + 1
+        high = np.zeros(nlut, dtype=bool)
+        cluster_val = np.arange(nlut).astype(self.clusters.dtype)
         for key, item in self.cluster_z.items():
-            if any([c > 2000 for c in item]):
-                cluster_mask[self.clusters == key] = True
+            if not len(item):
+                # Clusters without heights are never masked as high
+                continue
+            zmax = np.max(item)
+            if zmax <= 2000:
+                cluster_val[key] = np.mean(item)
+            elif np.nanmax(item) > 2000:
+                # Clusters with nan heights are high if any height is above
+                high[key] = True
+        cluster_mask = self.clusters.mask
+        cluster_mask |= high[labels]
 
         # Create additional fog cluster map
-        self.cluster_cth = np.ma.masked_where(cluster_mask, self.clusters)
-        for key, item in self.cluster_z.items():
-            if all([c <= 2000 for c in item]):
-                self.cluster_cth[self.cluster_cth == key] = np.mean(item)
+        self.cluster_cth = np.ma.masked_where(cluster_mask,
+                                              cluster_val[labels])
 
         # Create cluster mask for image array
         self.mask = cluster_mask
@@ -814,7 +921,6 @@ class SpatialHomogeneityFilter(BaseArrayFilter):
         """
         logger.info("Applying Spatial Clustering Inhomogeneity Filter")
         # Surface homogeneity test
-        cluster_mask = deepcopy(self.inmask)
         cluster, nlbl = ndimage.label(~self.clusters.mask)
         cluster_ma = np.ma.masked_where(self.inmask, self.clusters)
 
@@ -823,15 +929,16 @@ class SpatialHomogeneityFilter(BaseArrayFilter):
 
         # 4. Mask potential fog clouds with high spatial inhomogeneity
         sd_mask = cluster_sd > 2.5
-        cluster_dict = {key: sd_mask[key - 1] for key in np.arange(1, nlbl+1)}
-        for val in np.arange(1, nlbl+1):
-            ncluster = np.count_nonzero(cluster_ma == val)
-            if ncluster <= self.maxsize:
-                cluster_mask[cluster_ma == val] = cluster_dict[val]
-            else:
-                logger.info("Exclude cloud cluster {} of size {} from filter"
-                            .format(val, ncluster))
-                cluster_mask[cluster_ma == val] = 0
+        # Clusters above the maximal size are excluded from the filter
+        labels = cluster_ma.filled(0).astype(np.intp, copy=False)
+        sizes = np.bincount(labels.ravel(), minlength=nlbl + 1)
+        for val in np.flatnonzero(sizes[1:nlbl+1] > self.maxsize) + 1:
+            logger.info("Exclude cloud cluster {} of size {} from filter"
+                        .format(val, sizes[val]))
+        # Lookup table of masked clusters, label 0 marks unclustered pixels
+        lut = np.zeros(sizes.size, dtype=bool)
+        lut[1:nlbl+1] = sd_mask & (sizes[1:nlbl+1] <= self.maxsize)
+        cluster_mask = self.inmask | lut[labels]
 
         # Create cluster mask for image array
         self.mask = cluster_mask
@@ -880,6 +987,33 @@ class CloudPhysicsFilter(BaseArrayFilter):
         return True
 
 
+def _get_fog_base_height(args):
+    """Calculate cloud and fog base height with the low cloud model.
+
+    Module level worker for the process pool of the :class:`LowCloudFilter`.
+    The arguments are a tuple of liquid water path, cloud top height, cloud
+    top temperature, droplet effective radius, liquid water path correction
+    factor and fog base height substitution flag.
+    """
+    cwp, cth, ctt, reff, lwp_corr, substitude = args
+    lowcloud = LowWaterCloud(cth=cth,
+                             ctt=ctt,
+                             cwp=cwp * lwp_corr,
+                             cbh=0,
+                             reff=reff)
+    try:
+        # Calculate cloud base height
+        cbh = lowcloud.get_cloud_base_height(-100, 'basin')
+        # Get visibility and fog cloud base height
+        fbh = lowcloud.get_fog_base_height(substitude)
+    except DummyException as e:
+        logger.error(e, exc_info=True)
+        cbh = np.nan
+        fbh = np.nan
+
+    return cbh, fbh
+
+
 class LowCloudFilter(BaseArrayFilter):
     """Filtering low clouds for satellite images."""
     # Required inputs
@@ -917,54 +1051,28 @@ class LowCloudFilter(BaseArrayFilter):
             Filter image and filter mask.
         """
         logger.info("Applying Low Cloud Filter")
-        # Creating process pool
-        pool = mp.Pool(self.nprocs)
-        mlogger = mp.log_to_stderr()
-        mlogger.setLevel(logging.DEBUG)
-        # Declare result arrays without copy
-        self.cbh = np.empty(self.clusters.shape, dtype=np.float)
-        self.fbh = np.empty(self.clusters.shape, dtype=np.float)
         self.fog_mask = self.clusters.mask
         # Define mode of parallelisation
         if self.single:  # Run low cloud models parallized for single pixels
-            count_cells = 0
             logger.info("Run low cloud models for single cells")
-            applyres = []
-            task_count = self.clusters.count()
+            # Declare result arrays without copy
+            self.cbh = np.empty(self.clusters.shape, dtype=np.float)
+            self.fbh = np.empty(self.clusters.shape, dtype=np.float)
             if self.plot:
                 # Plot cloud top height distribution for clusters
                 self.plot_cluster_stat()
-            # Get pool result list
-            self.result_list = []
+            # Collect inputs of single cell processes
             self.index_list = []
-            # Loop over single cell processes
+            workinput = []
             for r, c in np.ndindex(self.clusters.squeeze().shape):
                 if self.clusters.mask[r, c] == 0:
                     self.index_list.append((r, c))
-                    count_cells += 1
-                    workinput = [self.lwp[r, c], self.cth[r, c],
-                                 self.ir108[r, c], self.reff[r, c]]
-                    applyres.append(pool.apply_async(self.get_fog_base_height,
-                                                     args=workinput,
-                                                     callback=self.log_result))
-            # Log tasks
-            while True:
-                incomplete_count = sum(1 for x in applyres if not x.ready())
-
-                if incomplete_count == 0:
-                    logger.info("All Done. Completed {} tasks"
-                                .format(task_count))
-                    break
-                remain = (float(task_count - incomplete_count)
-                          / task_count * 100)
-                logger.info("{} Tasks Remaining --- {:.2f} % Complete"
-                            .format(incomplete_count, remain))
-                time.sleep(1)
-            # Wait for all processes to finish
-            pool.close()
-            pool.join()
+                    workinput.append((self.lwp[r, c], self.cth[r, c],
+                                      self.ir108[r, c], self.reff[r, c]))
+            # Get pool result list
+            self.result_list = self.run_low_cloud_models(workinput)
             logger.info("Finished low cloud models for {} cells"
-                        .format(count_cells))
+                        .format(len(self.index_list)))
             # Create ground fog and low stratus cloud masks and cbh
             for i, indices in enumerate(self.index_list):
                 r, c = indices
@@ -986,42 +1094,25 @@ class LowCloudFilter(BaseArrayFilter):
             if self.plot:
                 # Plot cloud top height distribution for clusters
                 self.plot_cluster_stat()
-            # Loop over processes
             logger.info("Run low cloud models for cloud clusters")
-            applyres = []
-            task_count = len(lwp_cluster)
+            keys = list(lwp_cluster.keys())
+            workinput = [(lwp_cluster[key], cth_cluster[key],
+                          ctt_cluster[key], reff_cluster[key])
+                         for key in keys]
             # Get pool result list
-            self.result_list = []
-            for key in lwp_cluster.keys():
-                workinput = [lwp_cluster[key], cth_cluster[key],
-                             ctt_cluster[key], reff_cluster[key]]
-                applyres.append(pool.apply_async(self.get_fog_base_height,
-                                                 args=workinput,
-                                                 callback=self.log_result))
-            # Log tasks
-            while True:
-                incomplete_count = sum(1 for x in applyres if not x.ready())
-
-                if incomplete_count == 0:
-                    logger.info("All Done. Completed {} tasks"
-                                .format(task_count))
-                    break
-                remain = (float(task_count - incomplete_count)
-                          / task_count * 100)
-                logger.info("{} Tasks Remaining --- {:.2f} % Complete"
-                            .format(incomplete_count, remain))
-                time.sleep(1)
-            # Wait for all processes to finish
-            pool.close()
-            pool.join()
-            # Create ground fog and low stratus cloud masks and cbh
-            keys = lwp_cluster.keys()
-            for k, res in zip(keys, self.result_list):
-                self.cbh[self.clusters == k] = res[0]
-                self.fbh[self.clusters == k] = res[1]
-                # Mask non ground fog clouds
-                self.fog_mask[(self.clusters == k) & (self.fbh -
-                              self.elev > 0)] = True
+            self.result_list = self.run_low_cloud_models(workinput)
+            # Create ground fog and low stratus cloud masks and cbh from
+            # lookup tables of the cluster results
+            labels = self.clusters.filled(0).astype(np.intp, copy=False)
+            nlut = max([labels.max()] + keys) + 1
+            cbh_lut = np.full(nlut, np.nan)
+            fbh_lut = np.full(nlut, np.nan)
+            if keys:
+                cbh_lut[keys], fbh_lut[keys] = zip(*self.result_list)
+            self.cbh = cbh_lut[labels]
+            self.fbh = fbh_lut[labels]
+            # Mask non ground fog clouds
+            self.fog_mask |= np.ma.filled(self.fbh - self.elev > 0, False)
         # Create cloud physics mask for image array
         self.mask = self.fog_mask
 
@@ -1029,10 +1120,32 @@ class LowCloudFilter(BaseArrayFilter):
 
         return True
 
-    def log_result(self, result):
-        # This is called whenever a pool(i) returns a result.
-        # Results are modified only by the main process, not the pool workers.
-        self.result_list.append(result)
+    def run_low_cloud_models(self, workinput):
+        """Run the low cloud models for the given inputs in the process pool.
+
+        The inputs are sent to the workers in chunks, the results are
+        returned in the order of the inputs. The process pool is only
+        started if there are inputs. The models run in the current process
+        if the workers can not be started.
+        """
+        task_count = len(workinput)
+        if task_count == 0:
+            return []
+        pool = _get_executor(self.nprocs)
+        chunksize = max(1, task_count // (4 * self.nprocs))
+        payloads = [tuple(values) + (self.lwp_corr, self.substitude)
+                    for values in workinput]
+        try:
+            result_list = list(pool.map(_get_fog_base_height, payloads,
+                                        chunksize=chunksize))
+        except BrokenProcessPool as e:
+            logger.warning("Process pool failed: {}. Run low cloud models "
+                           "serially".format(e))
+            _shutdown_executor()
+            result_list = [_get_fog_base_height(p) for p in payloads]
+        logger.info("All Done. Completed {} tasks".format(task_count))
+
+        return result_list
 
     def get_fog_base_height(self, cwp, cth, ctt, reff):
         """ Calculate fog base heights for low cloud pixels with a
@@ -1040,22 +1153,8 @@ class LowCloudFilter(BaseArrayFilter):
         height / temperature and droplet effective radius from satellite
         retrievals.
         """
-        lowcloud = LowWaterCloud(cth=cth,
-                                 ctt=ctt,
-                                 cwp=cwp * self.lwp_corr,
-                                 cbh=0,
-                                 reff=reff)
-        try:
-            # Calculate cloud base height
-            cbh = lowcloud.get_cloud_base_height(-100, 'basin')
-            # Get visibility and fog cloud base height
-            fbh = lowcloud.get_fog_base_height(self.substitude)
-        except DummyException as e:
-            logger.error(e, exc_info=True)
-            cbh = np.nan
-            fbh = np.nan
-
-        return cbh, fbh
+        return _get_fog_base_height((cwp, cth, ctt, reff, self.lwp_corr,
+                                     self.substitude))
 
     def get_cluster_stat(self, clusters, values, exclude=[0],
                          noneg=True, stat='mean', data=False):
@@ -1068,6 +1167,8 @@ class LowCloudFilter(BaseArrayFilter):
         result = defaultdict(list)
         if np.ma.isMaskedArray(clusters):
             clusters = clusters.filled(0)
+        if stat == 'mean' and not data:
+            return self.get_cluster_mean(clusters, values, exclude, noneg)
         # Calculate mean values for clusters
         for index, key in np.ndenumerate(clusters):
             if key != 0:
@@ -1087,8 +1188,35 @@ class LowCloudFilter(BaseArrayFilter):
 
         return result
 
+    def get_cluster_mean(self, clusters, values, exclude=[0], noneg=True):
+        """Calculate the mean of an array of values for given cluster
+        structures with a labeled mean over the cluster array.
+
+        Excluded, negative and masked values are ignored. The mean is nan
+        for clusters without valid values.
+        """
+        clusters = np.ravel(clusters).astype(np.intp, copy=False)
+        values = np.ma.filled(np.ma.asarray(values, dtype=float),
+                              np.nan).ravel()
+        # Select valid values
+        valid = ~np.isnan(values)
+        if len(exclude) > 0:
+            valid &= ~np.isin(values, exclude)
+        if noneg:
+            valid &= values >= 0
+        keys = np.flatnonzero(np.bincount(clusters)[1:]) + 1
+        if keys.size == 0:
+            return {}
+        # Invalid values are assigned to the background label
+        labels = np.where(valid, clusters, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = ndimage.mean(values, labels=labels, index=keys)
+
+        return dict(zip(keys, means))
+
     def plot_cluster_stat(self, param=None, label='Cloud Top Height in m'):
         """Plot cloud top height distribution for cloud clusters"""
+        import matplotlib.pyplot as plt
         if param is None:
             param = self.cth
         clusterdata = self.get_cluster_stat(self.clusters, param,
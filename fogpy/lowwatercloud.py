@@ -43,7 +43,6 @@ The implementation is based on the following publications:
 import math
 import logging
 import time
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy.optimize import basinhopping
 from scipy.optimize import brute
@@ -59,6 +58,12 @@ class CloudLayer(object):
     cloud section from its vertical profile with defined extent and homogenius
     cloud parameters.
     The layer is defined by the bottom and top height in the cloud profile"""
+    # Many layers are created per cloud model optimisation, use fixed slots
+    # instead of an instance dictionary
+    __slots__ = ('bottom', 'top', 'z', 'debug', 'temp', 'press', 'psv', 'vmr',
+                 'lmr', 'rho', 'lrho', 'beta', 'lwc', 'reff', 'extinct',
+                 'visibility')
+
     def __init__(self, bottom, top, lowcloud, add=True):
         self.bottom = bottom  # Bottom height of the cloud layer
         self.top = top  # Top height of the cloud layer
@@ -95,9 +100,6 @@ class CloudLayer(object):
                                                                   self.debug))
 
         # Get layer liquid water density
-        self.lrho = lowcloud.get_liquid_density(self.press * 100,
-                                                self.check_temp(self.temp,
-                                                                'celsius'))
         self.lrho = 1000  # TODO Fix liquid water density method
         # Get in cloud mixing ratio beta
         self.beta = lowcloud.get_incloud_mixing_ratio(self.z, lowcloud.cth,
@@ -636,6 +638,7 @@ class LowWaterCloud(object):
 
     def plot_lowcloud(self, para, xlabel=None, save=None):
         """Plotting of selected low water cloud parameters."""
+        import matplotlib.pyplot as plt
         if self.layers == []:
             logger.info("No layer found. Nothing to plot")
         heights = [getattr(l, 'z') for l in self.layers]
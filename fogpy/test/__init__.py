@@ -24,7 +24,8 @@
 
 from fogpy.test import (test_lowwatercloud,
                         test_filters,
-                        test_algorithms
+                        test_algorithms,
+                        test_kernels
                         )
 
 import unittest
@@ -38,5 +39,6 @@ def suite():
     mysuite.addTests(test_lowwatercloud.suite())
     mysuite.addTests(test_filters.suite())
     mysuite.addTests(test_algorithms.suite())
+    mysuite.addTests(test_kernels.suite())
 
     return mysuite
@@ -30,6 +30,8 @@ import functools
 import pytest
 import copy
 
+from unittest import mock
+
 import pyorbital.orbital
 from datetime import datetime
 from fogpy.algorithms import BaseSatelliteAlgorithm
@@ -37,6 +39,7 @@ from fogpy.algorithms import DayFogLowStratusAlgorithm
 from fogpy.algorithms import NightFogLowStratusAlgorithm
 from fogpy.algorithms import LowCloudHeightAlgorithm
 from fogpy.algorithms import PanSharpeningAlgorithm
+from fogpy._kernels import CLOUD_STAGE, SNOW_STAGE, ICE_STAGE, CIRRUS_STAGE
 from fogpy.filters import CloudFilter
 from fogpy.filters import SnowFilter
 from fogpy.filters import IceCloudFilter
@@ -135,6 +138,25 @@ class Test_BaseSatelliteAlgorithm(unittest.TestCase):
         self.assertEqual(ret.shape, (4, 4))
         self.assertEqual(newalgo.shape, (4, 4))
 
+    def test_base_algorithm_precision(self):
+        newalgo = BaseSatelliteAlgorithm(ir108=self.testarray, **self.input)
+        self.assertEqual(newalgo.ir108.dtype, np.float64)
+        newalgo = BaseSatelliteAlgorithm(ir108=self.testarray,
+                                         precision='fp32', **self.input)
+        self.assertEqual(newalgo.ir108.dtype, np.float32)
+        # Only channel arrays are converted
+        self.assertEqual(newalgo.test1.dtype, np.float64)
+        self.assertRaises(ValueError, BaseSatelliteAlgorithm,
+                          ir108=self.testarray, precision='fp16')
+
+    def test_base_algorithm_shared_mask(self):
+        testmarray3d = self.testmarray[:, :, np.newaxis]
+        for marray in (self.testmarray, testmarray3d):
+            with mock.patch.object(BaseSatelliteAlgorithm, 'add_mask') as add:
+                BaseSatelliteAlgorithm(test1=marray, test2=marray)
+            # Evaluate results
+            self.assertEqual(add.call_count, 1)
+
 
 class Test_DayFogLowStratusAlgorithm(unittest.TestCase):
 
@@ -256,6 +278,89 @@ class Test_DayFogLowStratusAlgorithm(unittest.TestCase):
 #         np.save('/tmp/fog_testdata_fogmask.npy', np.ma.getdata(flsalgo.mask),
 #                 allow_pickle=True)
 
+    def test_fls_prefilters(self):
+        # Mask separate stripes in the channels
+        inputs = dict(self.input)
+        for i, name in enumerate(['ir108', 'ir039', 'vis008', 'nir016',
+                                  'vis006', 'ir087', 'ir120']):
+            mask = np.zeros(inputs[name].shape, dtype=bool)
+            mask[10 * i:10 * i + 5] = True
+            inputs[name] = np.ma.masked_array(inputs[name], mask)
+        flsalgo = DayFogLowStratusAlgorithm(**inputs)
+        flsalgo.apply_prefilters()
+        # Apply the filters in sequence to the same channels
+        filter_input = {key: getattr(flsalgo, key) for key in
+                        ['ir108', 'ir039', 'vis008', 'nir016', 'vis006',
+                         'ir087', 'ir120', 'lat', 'lon', 'time']}
+        cloudfilter = CloudFilter(flsalgo.ir108, **filter_input)
+        cloudfilter.apply()
+        snowfilter = SnowFilter(cloudfilter.result, **filter_input)
+        snowfilter.apply()
+        icefilter = IceCloudFilter(snowfilter.result, **filter_input)
+        icefilter.apply()
+        cirrusfilter = CirrusCloudFilter(icefilter.result, **filter_input)
+        cirrusfilter.apply()
+        vcloudmask = icefilter.mask | cirrusfilter.mask
+        # Masked channel values are excluded as well
+        mask = np.ma.getmaskarray(cirrusfilter.result)
+        for name in ['ir039', 'vis008', 'nir016', 'vis006', 'ir087',
+                     'ir120']:
+            mask = mask | np.ma.getmaskarray(filter_input[name])
+
+        # Evaluate results
+        for i in range(7):
+            self.assertTrue(flsalgo.mask[10 * i:10 * i + 5].all())
+        np.testing.assert_array_equal(flsalgo.mask, mask)
+        np.testing.assert_array_equal(np.ma.getmaskarray(flsalgo.vcloudmask),
+                                      np.ma.getmaskarray(vcloudmask))
+        np.testing.assert_array_equal(np.ma.filled(flsalgo.vcloudmask, False),
+                                      np.ma.filled(vcloudmask, False))
+
+    def test_fls_stage_mask(self):
+        flsalgo = DayFogLowStratusAlgorithm(**self.input)
+        flsalgo.apply_prefilters()
+        stage_mask = flsalgo.stage_mask
+        # Apply the filters separately
+        filter_input = {key: getattr(flsalgo, key) for key in
+                        ['ir108', 'ir039', 'vis008', 'nir016', 'vis006',
+                         'ir087', 'ir120', 'lat', 'lon', 'time']}
+        stages = {}
+        for stage, filter_class in [(CLOUD_STAGE, CloudFilter),
+                                    (SNOW_STAGE, SnowFilter),
+                                    (ICE_STAGE, IceCloudFilter),
+                                    (CIRRUS_STAGE, CirrusCloudFilter)]:
+            testfilter = filter_class(flsalgo.ir108, **filter_input)
+            testfilter.apply()
+            stages[stage] = np.ma.getdata(testfilter.mask)
+
+        # Evaluate results
+        self.assertEqual(stage_mask.dtype, np.uint8)
+        self.assertEqual(stage_mask.shape, (141, 298))
+        self.assertLessEqual(stage_mask.max(), 15)
+        for stage, mask in stages.items():
+            np.testing.assert_array_equal((stage_mask & stage) != 0, mask)
+        self.assertEqual(flsalgo.vcloudmask.sum(),
+                         np.sum(stages[ICE_STAGE] | stages[CIRRUS_STAGE]))
+        # A second run doesn't change the previous stage codes
+        flsalgo.apply_prefilters()
+        self.assertFalse(np.shares_memory(stage_mask, flsalgo.stage_mask))
+        np.testing.assert_array_equal(stage_mask, flsalgo.stage_mask)
+
+    def test_fls_algorithm_precision(self):
+        masks = {}
+        for precision, dtype in [('fp32', np.float32), ('fp64', np.float64)]:
+            flsalgo = DayFogLowStratusAlgorithm(precision=precision,
+                                                **self.input)
+            flsalgo.apply_prefilters()
+            self.assertEqual(flsalgo.ir108.dtype, dtype)
+            self.assertEqual(flsalgo.lat.dtype, np.float64)
+            masks[precision] = flsalgo.mask
+        flsalgo = DayFogLowStratusAlgorithm(**self.input)
+        self.assertEqual(flsalgo.ir108.dtype, np.float32)
+
+        # Evaluate results
+        np.testing.assert_array_equal(masks['fp32'], masks['fp64'])
+
     # Using other tset data set
     @unittest.skipUnless(
             os.getenv("FOGPY_SLOW_TESTS"),
@@ -760,6 +865,18 @@ class Test_NightFogLowStratusAlgorithm(unittest.TestCase):
         self.assertEqual(flsalgo.shape, (141, 298))
         self.assertEqual(np.ma.is_mask(flsalgo.mask), True)
 
+    def test_nightfls_algorithm_precision(self):
+        masks = {}
+        for precision, dtype in [('fp32', np.float32), ('fp64', np.float64)]:
+            flsalgo = NightFogLowStratusAlgorithm(precision=precision,
+                                                  **self.input)
+            ret, mask = flsalgo.run()
+            self.assertEqual(flsalgo.ir108.dtype, dtype)
+            masks[precision] = mask
+
+        # Evaluate results
+        np.testing.assert_array_equal(masks['fp32'], masks['fp64'])
+
     def test_nightfls_algorithm2(self):
         flsalgo = NightFogLowStratusAlgorithm(**self.input2)
         ret, mask = flsalgo.run()
@@ -27,20 +27,28 @@ import os
 import functools
 import fogpy
 import pkg_resources
+import subprocess
+import sys
+import tempfile
 
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from unittest import mock
 from fogpy.filters import BaseArrayFilter
 from fogpy.filters import CloudFilter
 from fogpy.filters import SnowFilter
 from fogpy.filters import IceCloudFilter
 from fogpy.filters import CirrusCloudFilter
+from fogpy.filters import _nearest_index
 from fogpy.filters import WaterCloudFilter
 from fogpy.filters import SpatialCloudTopHeightFilter
+from fogpy.filters import SpatialCloudTopHeightFilter_old
 from fogpy.filters import SpatialHomogeneityFilter
 from fogpy.filters import LowCloudFilter
 from fogpy.filters import CloudMotionFilter
 from fogpy.filters import StationFusionFilter
 from fogpy.filters import NumericalModelFilter
+from fogpy.filters import MaskedView
 from fogpy.algorithms import DayFogLowStratusAlgorithm
 from pyresample import geometry
 from scipy import ndimage
@@ -112,6 +120,31 @@ class Test_ArrayFilter(unittest.TestCase):
         self.assertEqual(np.ma.is_masked(ret), True)
         self.assertEqual(np.ma.is_mask(newfilter.inmask), True)
 
+    def test_maskedview_filter(self):
+        mask = self.testarray > 10
+        newfilter = BaseArrayFilter(MaskedView(self.testarray, mask))
+        newfilter.attrlist = []
+        ret, mask = newfilter.apply()
+        self.assertEqual(newfilter.arr.shape, (4, 4))
+        self.assertEqual(np.sum(newfilter.inmask), 5)
+        self.assertTrue(np.shares_memory(newfilter.arr.data, self.testarray))
+
+    def test_array_filter_nostats(self):
+        newfilter = BaseArrayFilter(self.testarray, stats=False)
+        newfilter.attrlist = []
+        ret, mask = newfilter.apply()
+        self.assertEqual(ret.shape, (4, 4))
+        self.assertFalse(hasattr(newfilter, 'filter_num'))
+
+    def test_array_filter_time(self):
+        newfilter = BaseArrayFilter(self.testarray)
+        self.assertIsNone(newfilter._time)
+        self.assertIsInstance(newfilter.time, datetime)
+        self.assertIs(newfilter.time, newfilter.time)
+        reftime = datetime(2013, 12, 12, 8, 0, 0)
+        newfilter = BaseArrayFilter(self.testarray, time=reftime)
+        self.assertEqual(newfilter.time, reftime)
+
     def test_array_filter_param(self):
         param = {'test1': 'test1', 'test2': 0, 'test3': 0.1, 'test4': True}
         newfilter = BaseArrayFilter(self.testarray, **param)
@@ -334,6 +367,18 @@ class Test_CirrusCloudFilter(unittest.TestCase):
                                                                          50])
         self.assertEqual(np.sum(testfilter.mask), 9398)
 
+    def test_cirrus_lut(self):
+        # Nearest BT key with lower key on ties and first key for nan values
+        bt = np.array([[200., 265., 265.1], [284.9, np.nan, 400.]])
+        idx = _nearest_index(bt, CirrusCloudFilter.lut_bt)
+        np.testing.assert_array_equal(idx, [[0, 0, 1], [2, 0, 5]])
+        # Lookup table array matches lookup table dictionary
+        lut = CirrusCloudFilter.lut
+        thres = CirrusCloudFilter.lut_thres
+        self.assertEqual(thres.shape, (6, 5))
+        self.assertEqual(thres[2, 3], lut[280][1.75])
+        self.assertEqual(thres[5, 4], lut[310][2.0])
+
 
 class Test_WaterCloudFilter(unittest.TestCase):
 
@@ -384,7 +429,7 @@ class Test_WaterCloudFilter(unittest.TestCase):
                                        np.sum(testfilter.cloudmask), 42018)
         np.testing.assert_almost_equal(np.sum(testfilter.cloudmask), 20551)
         self.assertEqual(np.sum(testfilter.mask), 19857)
-        self.assertEqual(testfilter.line, 141)
+        self.assertEqual(testfilter.mask.shape, self.ir039.shape)
 
 
 class Test_SpatialCloudTopHeightFilter(unittest.TestCase):
@@ -475,6 +520,20 @@ class Test_SpatialCloudTopHeightFilter(unittest.TestCase):
         self.assertLessEqual(np.max(lowcth), 1000)
         self.assertLessEqual(np.max(lowcth2), 1000)
 
+    def test_spatial_cth_filter_old_empty_cluster(self):
+        # Create cloud filter with an empty cluster height entry
+        clusters = np.ma.masked_equal(np.repeat([[0, 1, 2]], 10, axis=0), 0)
+        ir108 = self.ir108[:, :3]
+        cluster_z = {1: [], 2: [900., 2500.]}
+        testfilter = SpatialCloudTopHeightFilter_old(ir108, ir108=ir108,
+                                                     clusters=clusters,
+                                                     cluster_z=cluster_z)
+        ret, mask = testfilter.apply()
+
+        # Evaluate results
+        np.testing.assert_array_equal(mask[:, 1], False)
+        np.testing.assert_array_equal(mask[:, 2], True)
+
 
 class Test_SpatialHomogeneityFilter(unittest.TestCase):
 
@@ -6477,6 +6536,63 @@ class Test_LowCloudFilter(unittest.TestCase):
         self.assertEqual(np.sum(self.cloudmask), 20551)
         self.assertEqual(np.nanmax(len(testfilter.result_list)), 1)
 
+    def test_lowcloud_filter_executor(self):
+        fogpy.filters._shutdown_executor()
+        testfilter = LowCloudFilter(self.input['ir108'], **self.input)
+        testfilter.substitude = True
+        # No process pool is started without inputs
+        self.assertEqual(testfilter.run_low_cloud_models([]), [])
+        self.assertIsNone(fogpy.filters._executor)
+        pool = fogpy.filters._get_executor(2)
+
+        # Evaluate results
+        self.assertIs(fogpy.filters._get_executor(2), pool)
+        if 'fork' in fogpy.filters.mp.get_all_start_methods():
+            self.assertEqual(pool._mp_context.get_start_method(), 'fork')
+        self.assertEqual(pool.submit(abs, -1).result(), 1)
+        fogpy.filters._shutdown_executor()
+        self.assertIsNone(fogpy.filters._executor)
+
+    def test_lowcloud_filter_broken_pool(self):
+        testfilter = LowCloudFilter(self.input['ir108'], **self.input)
+        workinput = [(np.nan, 1000., 270., 10.)]
+        pool = mock.Mock()
+        pool.map.side_effect = BrokenProcessPool
+        with mock.patch('fogpy.filters._get_executor', return_value=pool):
+            ret = testfilter.run_low_cloud_models(workinput)
+
+        # Evaluate results
+        self.assertEqual(pool.map.call_count, 1)
+        self.assertEqual(len(ret), 1)
+        self.assertTrue(np.all(np.isnan(ret[0])))
+
+    def test_lowcloud_filter_unguarded_script(self):
+        # Run the low cloud models from a script without main guard
+        script = ("import numpy as np\n"
+                  "from fogpy.filters import LowCloudFilter\n"
+                  "arr = np.ones((1, 1))\n"
+                  "clusters = np.ma.masked_array(np.ones((1, 1), int), False)\n"
+                  "testfilter = LowCloudFilter(arr, ir108=arr, lwp=arr, "
+                  "cth=arr, clusters=clusters, reff=arr, elev=arr, "
+                  "nprocs=2)\n"
+                  "print(len(testfilter.run_low_cloud_models("
+                  "[(np.nan, 1000., 270., 10.)] * 3)))\n")
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+             env.get('PYTHONPATH', '')])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'lowcloud_script.py')
+            with open(path, 'w') as f:
+                f.write(script)
+            ret = subprocess.run([sys.executable, path], env=env, cwd=tmpdir,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, timeout=300)
+
+        # Evaluate results
+        self.assertEqual(ret.returncode, 0, ret.stderr.decode())
+        self.assertEqual(ret.stdout.decode().split()[-1], '3')
+
     def test_lowcloud_filter_single(self):
         # Create cloud filter
         input_single = self.input
@@ -6531,6 +6647,21 @@ class Test_LowCloudFilter(unittest.TestCase):
         self.assertEqual(np.sum(testfilter.fog_mask), nfog)
         self.assertEqual(np.sum(testfilter.mask), nfog)
 
+    def test_lowcloud_filter_cluster_mean(self):
+        # Create cloud filter
+        testfilter = LowCloudFilter(self.input['ir108'], **self.input)
+        clusters = np.ma.masked_array([[1, 1, 2], [3, 3, 4]],
+                                      [[0, 0, 0], [0, 0, 1]])
+        values = np.ma.masked_array([[-1., 5., 0.], [2., np.nan, 7.]],
+                                    [[0, 0, 0], [0, 1, 0]])
+        ret = testfilter.get_cluster_stat(clusters, values)
+
+        # Evaluate results
+        self.assertEqual(sorted(ret), [1, 2, 3])
+        self.assertEqual(ret[1], 5.)
+        self.assertTrue(np.isnan(ret[2]))
+        self.assertEqual(ret[3], 2.)
+
     @unittest.skip("Plotting tests temporarily disabled")
     def test_lowcloud_filter_cluster_plot(self):
         self.input['save'] = True
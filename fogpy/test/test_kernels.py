@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2017
+# Author(s):
+#   Thomas Leppelt <thomas.leppelt@dwd.de>
+
+# This file is part of the fogpy package.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" This module tests the fused filter kernels """
+
+import unittest
+import numpy as np
+import os
+import functools
+import pkg_resources
+import subprocess
+import sys
+
+from datetime import datetime
+from fogpy import _kernels
+from fogpy.filters import CloudFilter
+from fogpy.filters import SnowFilter
+from fogpy.filters import IceCloudFilter
+from fogpy.filters import CirrusCloudFilter
+
+# Test data array order:
+# ir108, ir039, vis08, nir16, vis06, ir087, ir120, elev, cot, reff, cwp,
+# lat, lon, cth
+
+# Import test data
+fogres = functools.partial(pkg_resources.resource_filename, "fogpy")
+testfile = fogres(os.path.join('etc', 'fog_testdata.npy'))
+testdata = np.load(testfile)
+
+
+def _compare_cuda_fog_mask_stages():
+    """Compare the CUDA and the CPU fused filter kernel on a test data subset.
+
+    Runs in a separate process with the numba CUDA simulator enabled.
+    """
+    from fogpy import _kernels_cuda
+    inputs = [arr.squeeze()[:32, :48] for arr in np.dsplit(testdata, 14)]
+    ir108, ir039, vis008, nir016, vis006, ir087, ir120 = inputs[:7]
+    cirrusfilter = CirrusCloudFilter(ir108, ir108=ir108, ir087=ir087,
+                                     ir120=ir120, lat=inputs[11],
+                                     lon=inputs[12],
+                                     time=datetime(2013, 11, 12, 8, 30, 00))
+    args = (ir108, vis008, nir016, vis006, ir087, ir120,
+            ir108 - ir039 > -3.5, cirrusfilter.get_bt_thres())
+    assert _kernels_cuda.is_available()
+    stages = _kernels_cuda.fog_mask_stages(*args)
+    np.testing.assert_array_equal(stages, _kernels.fog_mask_stages(*args))
+    assert stages.any()
+
+
+class Test_CombinedFogMask(unittest.TestCase):
+
+    def setUp(self):
+        # Load test data
+        inputs = [arr.squeeze() for arr in np.dsplit(testdata, 14)]
+        self.ir108 = inputs[0]
+        self.ir039 = inputs[1]
+        self.vis008 = inputs[2]
+        self.nir016 = inputs[3]
+        self.vis006 = inputs[4]
+        self.ir087 = inputs[5]
+        self.ir120 = inputs[6]
+        self.lat = inputs[11]
+        self.lon = inputs[12]
+
+        self.time = datetime(2013, 11, 12, 8, 30, 00)
+
+        self.input = {'ir108': self.ir108,
+                      'ir039': self.ir039,
+                      'vis008': self.vis008,
+                      'nir016': self.nir016,
+                      'vis006': self.vis006,
+                      'ir087': self.ir087,
+                      'ir120': self.ir120,
+                      'lat': self.lat,
+                      'lon': self.lon,
+                      'time': self.time}
+
+    def tearDown(self):
+        pass
+
+    def test_fog_mask_stages(self):
+        # Apply filters separately
+        cloudfilter = CloudFilter(self.ir108, **self.input)
+        cloudfilter.apply()
+        snowfilter = SnowFilter(self.ir108, **self.input)
+        snowfilter.apply()
+        icefilter = IceCloudFilter(self.ir108, **self.input)
+        icefilter.apply()
+        cirrusfilter = CirrusCloudFilter(self.ir108, **self.input)
+        cirrusfilter.apply()
+        # Apply fused filter kernel
+        stages = _kernels.fog_mask_stages(
+            self.ir108, self.vis008, self.nir016, self.vis006, self.ir087,
+            self.ir120, cloudfilter.mask, cirrusfilter.bt_thres)
+
+        # Evaluate results
+        self.assertEqual(stages.dtype, np.uint8)
+        self.assertEqual(stages.shape, (141, 298))
+        self.assertLessEqual(stages.max(), 15)
+        np.testing.assert_array_equal(
+            (stages & _kernels.CLOUD_STAGE) != 0, cloudfilter.mask)
+        np.testing.assert_array_equal(
+            (stages & _kernels.SNOW_STAGE) != 0, snowfilter.mask)
+        np.testing.assert_array_equal(
+            (stages & _kernels.ICE_STAGE) != 0, icefilter.mask)
+        np.testing.assert_array_equal(
+            (stages & _kernels.CIRRUS_STAGE) != 0, cirrusfilter.mask)
+
+    def test_fog_mask_stages_numpy(self):
+        cirrusfilter = CirrusCloudFilter(self.ir108, **self.input)
+        bt_thres = cirrusfilter.get_bt_thres()
+        for dtype in (np.float32, np.float64):
+            channels = [arr.astype(dtype) for arr in (
+                self.ir108, self.vis008, self.nir016, self.vis006,
+                self.ir087, self.ir120)]
+            args = channels + [self.ir108 - self.ir039 > -3.5, bt_thres]
+            stages = _kernels.fog_mask_stages(*args)
+            np_stages = np.empty(stages.shape, dtype=np.uint8)
+            _kernels._fog_mask_stages_numpy(*args, _kernels._snow_thres(dtype),
+                                            np_stages)
+
+            # Evaluate results
+            np.testing.assert_array_equal(stages, np_stages)
+
+    @unittest.skipIf(_kernels.njit is None, "Numba is not available")
+    def test_fog_mask_stages_cuda(self):
+        # Run the CUDA kernel in the simulator, which has to be enabled
+        # before numba is imported
+        env = dict(os.environ, NUMBA_ENABLE_CUDASIM='1')
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+             env.get('PYTHONPATH', '')])
+        ret = subprocess.run(
+            [sys.executable, '-c',
+             'from fogpy.test.test_kernels import '
+             '_compare_cuda_fog_mask_stages; _compare_cuda_fog_mask_stages()'],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # Evaluate results
+        self.assertEqual(ret.returncode, 0, ret.stderr.decode())
+
+    def test_snow_mask(self):
+        snowfilter = SnowFilter(self.ir108, **self.input)
+        snowfilter.apply()
+        mask = _kernels.snow_mask(self.vis006, self.vis008, self.nir016,
+                                  self.ir108)
+        np_mask = np.empty(mask.shape, dtype=bool)
+        _kernels._snow_mask_numpy(self.vis006, self.vis008, self.nir016,
+                                  self.ir108,
+                                  _kernels._snow_thres(self.ir108.dtype),
+                                  np_mask)
+
+        # Evaluate results
+        np.testing.assert_array_equal(mask, snowfilter.mask)
+        np.testing.assert_array_equal(mask, np_mask)
+
+    def test_snow_mask_fp32(self):
+        # Single precision values around the reflectance and NDSI thresholds
+        steps = np.arange(-50, 50, dtype=np.float32)
+        vis008 = np.float32(11) + steps * np.spacing(np.float32(11))
+        vis006 = np.float32(70) + steps * np.spacing(np.float32(70))
+        vis008, vis006 = np.meshgrid(vis008, vis006)
+        nir016 = np.full(vis008.shape, 30, dtype=np.float32)
+        ir108 = np.full(vis008.shape, 260, dtype=np.float32)
+        ndsi = (vis006 - nir016) / (vis006 + nir016)
+        # Snow test of the snow filter in single precision
+        snow = (vis008 / 100 >= 0.11) & (ir108 >= 256) & (ndsi >= 0.4)
+        mask = _kernels.snow_mask(vis006, vis008, nir016, ir108)
+        np_mask = np.empty(mask.shape, dtype=bool)
+        _kernels._snow_mask_numpy(vis006.ravel(), vis008.ravel(),
+                                  nir016.ravel(), ir108.ravel(),
+                                  _kernels._snow_thres(np.float32),
+                                  np_mask.reshape(-1))
+        zeros = np.zeros(vis008.shape, dtype=np.float32)
+        stages = _kernels.fog_mask_stages(ir108, vis008, nir016, vis006, ir108,
+                                          ir108, zeros > 0, zeros)
+
+        # Evaluate results
+        self.assertTrue(snow.any())
+        self.assertFalse(snow.all())
+        np.testing.assert_array_equal(mask, snow)
+        np.testing.assert_array_equal(np_mask, snow)
+        np.testing.assert_array_equal((stages & _kernels.SNOW_STAGE) != 0,
+                                      snow)
+
+    def test_cloud_confidence(self):
+        diff = self.ir108 - self.ir039
+        ccl, mask = _kernels.cloud_confidence(diff, -3.5, 5)
+        np_ccl = (diff + 3.5 - 5) / -10.
+        np_ccl[np_ccl > 1] = 1
+        np_ccl[np_ccl < 0] = 0
+
+        # Evaluate results
+        np.testing.assert_array_almost_equal(ccl, np_ccl)
+        np.testing.assert_array_equal(mask, diff > -3.5)
+
+    def test_ice_cirrus_mask(self):
+        icefilter = IceCloudFilter(self.ir108, **self.input)
+        icefilter.apply()
+        cirrusfilter = CirrusCloudFilter(self.ir108, **self.input)
+        cirrusfilter.apply()
+        ice = _kernels.ice_mask(self.ir120, self.ir087, self.ir108)
+        cirrus = _kernels.cirrus_mask(self.ir108, self.ir087, self.ir120,
+                                      cirrusfilter.bt_thres)
+
+        # Evaluate results
+        np.testing.assert_array_equal(ice, (icefilter.ic_diff < 2.5) |
+                                      (self.ir108 < 250))
+        np.testing.assert_array_equal(cirrus, cirrusfilter.bt_ci_mask |
+                                      cirrusfilter.strong_ci_mask)
+
+
+class Test_Histogram(unittest.TestCase):
+
+    def setUp(self):
+        # Load test data
+        inputs = np.dsplit(testdata, 14)
+        self.diff = (inputs[0] - inputs[1]).ravel()
+
+    def tearDown(self):
+        pass
+
+    def test_histogram(self):
+        for dtype in (np.float32, np.float64, np.int32):
+            data = self.diff.astype(dtype)
+            hist, edges = _kernels.histogram(data, bins='auto')
+            np_hist, np_edges = np.histogram(data, bins='auto')
+
+            # Evaluate results
+            np.testing.assert_array_equal(edges, np_edges)
+            np.testing.assert_array_equal(hist, np_hist)
+            self.assertEqual(np.sum(hist), data.size)
+
+
+def suite():
+    """The test suite for test_kernels.
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(Test_CombinedFogMask))
+    mysuite.addTest(loader.loadTestsFromTestCase(Test_Histogram))
+
+    return mysuite
+
+
+if __name__ == "__main__":
+    unittest.main()
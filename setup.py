@@ -87,5 +87,6 @@ setup(
                       "opencv-python >= 4.1",
                       "opencv-contrib-python",
                       'trollbufr >= 0.10'],
+    extras_require={'numba': ['numba >= 0.49']},
     tests_require=[],
 )